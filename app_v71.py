@@ -6,14 +6,27 @@ import os
 import re
 import json
 import time
+import threading
 from datetime import datetime, timedelta
 import altair as alt
-import shutil
 import requests
 import yfinance as yf
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import io
+from kite_store import MonthPartitionedStore, default_store_dir, migrate_csv_to_store, file_fingerprint, NUMERIC_COLS, LIST_COLS
+from kite_sqlite import KiteSqliteStore, default_sqlite_path, STRATEGY_LABELS, base_name
+from kite_backup import BackupJournal, default_backup_dir
+from kite_frame import canonical_frame, build_day_views, WindRuns
+from kite_presence import PresenceMatrix, TurnoverPrefix
+from kite_cycle import segment_cycles
+from kite_fetch import fetch_all, shared_pool, LastGood, BackgroundRefresher, Coalescer, IndexQuoteProvider, circuit, circuit_states, FETCH_BUDGET
+from kite_history import load_history_arrays, history_frame, history_arrays_from_frame, read_history_csv, import_history_csv
+from kite_symbols import build_resolver, master_signature, fetch_isin_master, save_master_file, MASTER_FILE
+
+# 讀檔快取回傳的是所有 session 共用的 DataFrame，開啟 Copy-on-Write 避免呼叫端改到共用資料 (pandas 3 已預設開啟)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
 # 修正 Pydantic 錯誤
 try:
@@ -163,7 +176,10 @@ if GOOGLE_API_KEY:
     )
 
 DB_FILE = 'stock_data_v74.csv' 
-BACKUP_FILE = 'stock_data_backup.csv'
+DB_STORE_DIR = default_store_dir(DB_FILE) # 分月 Parquet 資料庫 (stock_data_v74_store/)
+DB_SQLITE_FILE = default_sqlite_path(DB_FILE) # 選股出現紀錄索引 (stock_data_v74.sqlite)
+DB_BACKUP_DIR = default_backup_dir(DB_FILE) # 增量備份日誌 (stock_data_v74_backup/)
+STOCK_MASTER_FILE = MASTER_FILE # 全市場股票主檔 (代號/名稱/上市櫃/產業/別名)，後台可從證交所更新
 
 # ▼▼▼▼▼▼ 請確保補上這兩行 ▼▼▼▼▼▼
 HISTORY_FILE_TPEX = 'kite_history.csv'       # 原本的櫃買歷史檔
@@ -238,12 +254,7 @@ MASTER_STOCK_DB = {
     "6739": ("竹陞科技", "智能工廠"), "4971": ("IET-KY", "三五族/砷化鎵"), "9105": ("泰金寶-DR", "組裝代工")
 }
 
-# --- 4. 自動生成索引 ---
-NAME_TO_SECTOR = {}
-NAME_TO_CODE = {}
-for code, (name, sector) in MASTER_STOCK_DB.items():
-    NAME_TO_SECTOR[name] = sector
-    NAME_TO_CODE[name] = code
+# --- 4. 自動生成索引 (名稱 -> 代號的查找表由 SymbolResolver 建立) ---
 
 # 別名對照
 ALIAS_MAP = {
@@ -268,25 +279,16 @@ FORCE_FIX_SECTOR = {
 }
 
 # --- 智慧查找函式 ---
+# resolver 在所有 session 之間共用 (查過的名稱會記住)；主檔內容或全市場主檔改變時簽章不同，才會重建
+# 手動維護的 MASTER_STOCK_DB 疊在全市場主檔上 (族群以手動分類為準)
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _build_symbol_resolver(signature, master_file_fingerprint):
+    return build_resolver(MASTER_STOCK_DB, ALIAS_MAP, FORCE_FIX_SECTOR, STOCK_MASTER_FILE)
+
+SYMBOLS = _build_symbol_resolver(master_signature(MASTER_STOCK_DB, ALIAS_MAP, FORCE_FIX_SECTOR), file_fingerprint(STOCK_MASTER_FILE))
+
 def smart_get_code_and_sector(stock_input):
-    raw = str(stock_input).strip()
-    clean = raw.replace("(CB)", "").strip()
-    if clean in ALIAS_MAP: clean = ALIAS_MAP[clean]
-    clean_no_star = clean.replace("*", "")
-    
-    code = None
-    if clean in NAME_TO_CODE: code = NAME_TO_CODE[clean]
-    elif clean_no_star in NAME_TO_CODE: code = NAME_TO_CODE[clean_no_star]
-    elif clean.isdigit() and clean in MASTER_STOCK_DB: code = clean
-        
-    sector = "其他"
-    if clean in FORCE_FIX_SECTOR: sector = FORCE_FIX_SECTOR[clean]
-    elif code and code in MASTER_STOCK_DB: sector = MASTER_STOCK_DB[code][1]
-        
-    name = clean
-    if code and code in MASTER_STOCK_DB: name = MASTER_STOCK_DB[code][0]
-    
-    return code, name, sector
+    return SYMBOLS.resolve(stock_input)
 
 def get_stock_sector(identifier):
     _, _, sector = smart_get_code_and_sector(identifier)
@@ -331,8 +333,7 @@ def prefetch_turnover_data(stock_list_str, target_date, manual_override_json=Non
         code, db_name, _ = smart_get_code_and_sector(name)
         if code:
             code_map[code] = name 
-            tickers.append(f"{code}.TW")
-            tickers.append(f"{code}.TWO")
+            tickers.extend(SYMBOLS.tickers(code)) # 主檔知道上市/上櫃就只抓一個
             
     if not tickers: return result_map
     
@@ -346,14 +347,14 @@ def prefetch_turnover_data(stock_list_str, target_date, manual_override_json=Non
         end_str = end_dt.strftime("%Y-%m-%d")
         
         # 使用 threads=True 加速
-        data = yf.download(tickers, start=start_str, end=end_str, group_by='ticker', progress=False, threads=True)
+        data = YF_STOCK_CIRCUIT.call(yf.download, tickers, start=start_str, end=end_str, group_by='ticker', progress=False, threads=True, failed=lambda d: d is None or d.empty)
+        if data is None: data = pd.DataFrame() # 熔斷中：直接走下面的 Fast Info (熔斷中同樣跳過)
         
         for code, name in code_map.items():
             found_val = 0
             # A. 先試 History Data
-            for suffix in ['.TW', '.TWO']:
+            for ticker in SYMBOLS.tickers(code):
                 try:
-                    ticker = f"{code}{suffix}"
                     if ticker in data.columns.levels[0]:
                         df = data[ticker]
                         if not df.empty:
@@ -380,13 +381,10 @@ def prefetch_turnover_data(stock_list_str, target_date, manual_override_json=Non
             
             # B. 【關鍵修復】如果 History 抓不到 (found_val=0)，改用 Fast Info (即時數據)
             if found_val == 0:
-                for suffix in ['.TW', '.TWO']:
+                for ticker in SYMBOLS.tickers(code):
                     try:
-                        ticker_obj = yf.Ticker(f"{code}{suffix}")
-                        fi = ticker_obj.fast_info
-                        # 檢查是否有今日數據
-                        last_price = fi.get('last_price', 0)
-                        last_vol = fi.get('last_volume', 0)
+                        # 檢查是否有今日數據 (個股來源熔斷中直接拿到 0，不必等 timeout)
+                        last_price, last_vol = YF_STOCK_CIRCUIT.call(_fast_info_price_volume, ticker, default=(0, 0))
                         
                         # 簡單檢核：如果價格>0且量>0，就當作是有效的
                         if last_price > 0 and last_vol > 0:
@@ -506,6 +504,20 @@ def make_sparkline_svg(data_list, color_hex, width=200, height=50):
 from datetime import datetime
 import pytz # 確保有導入時區庫，用於判斷台股日期
 
+# --- 外部資料來源熔斷器 ---
+# 雲端主機常被 MIS 擋下，每次都等滿 timeout 會拖慢整頁：連續失敗就暫停該來源一段時間，直接走備援 / 顯示預設值。
+# yfinance 同時服務很多代號，單一代號失敗不做負向快取 (negative_ttl=0)，只在連續失敗時熔斷。
+# 指數報價 / 走勢圖與個股批次下載各用一個熔斷器：個股那邊失敗不會連帶讓指數報價停擺。
+# 逐檔 fast_info 也走個股熔斷器，但試上市/上櫃後綴時查無資料是正常的，不計入失敗。
+MIS_CIRCUIT = circuit('證交所 MIS', threshold=3, cooldown=120, negative_ttl=15)
+YF_CIRCUIT = circuit('yfinance 指數', threshold=5, cooldown=60)
+YF_STOCK_CIRCUIT = circuit('yfinance 個股', threshold=5, cooldown=60)
+CNN_CIRCUIT = circuit('CNN 恐懼貪婪', threshold=2, cooldown=300, negative_ttl=30)
+YAHOO_RANK_CIRCUIT = circuit('Yahoo 成交值排行', threshold=2, cooldown=180, negative_ttl=30)
+
+def _http_failed(r):
+    return r.status_code != 200
+
 # --- [V210 終極版] 串接證交所官方 MIS API 獲取最權威指數資料 ---
 def fetch_official_tw_index_data():
     """
@@ -525,9 +537,9 @@ def fetch_official_tw_index_data():
     try:
         # 加入一個隨機參數避免快取
         timestamp = int(time.time() * 1000)
-        r = requests.get(f"{api_url}&_={timestamp}", headers=headers, timeout=5)
+        r = MIS_CIRCUIT.call(requests.get, f"{api_url}&_={timestamp}", headers=headers, timeout=5, failed=_http_failed)
         
-        if r.status_code == 200:
+        if r is not None and r.status_code == 200:
             data = r.json()
             if 'msgArray' not in data: return {}
             
@@ -566,93 +578,168 @@ def fetch_official_tw_index_data():
 
 
 # --- 全球市場即時報價 (V210: 官方訊號源終極版) ---
-@st.cache_data(ttl=20)
-def get_global_market_data_with_chart():
-    try:
-        indices = {
-            "^TWII": "🇹🇼 加權指數", 
-            "^TWOII": "🇹🇼 櫃買指數", 
-            "^N225": "🇯🇵 日經225",
-            "^DJI": "🇺🇸 道瓊工業", 
-            "^IXIC": "🇺🇸 那斯達克", 
-            "^SOX": "🇺🇸 費城半導體",
-            "BTC-USD": "₿ 比特幣", 
-            "ETH-USD": "Ξ 乙太幣"
-        }
-        market_data = []
+MARKET_REFRESH_SECONDS = 20
+GLOBAL_MARKET_INDICES = {
+    "^TWII": "🇹🇼 加權指數", 
+    "^TWOII": "🇹🇼 櫃買指數", 
+    "^N225": "🇯🇵 日經225",
+    "^DJI": "🇺🇸 道瓊工業", 
+    "^IXIC": "🇺🇸 那斯達克", 
+    "^SOX": "🇺🇸 費城半導體",
+    "BTC-USD": "₿ 比特幣", 
+    "ETH-USD": "Ξ 乙太幣"
+}
 
-        # 【V210 新增】優先一次性抓取台股官方資料
-        tw_official_data = fetch_official_tw_index_data()
-        
-        for ticker_code, name in indices.items():
-            try:
-                # 1. 初始化變數
-                last_price = None
-                change = 0
-                pct_change = 0
-                
-                # 2. 決定價格數據來源 (Price Source)
-                # 【策略 A】台灣指數：直接使用官方 API 結果
-                if ticker_code in ["^TWII", "^TWOII"] and ticker_code in tw_official_data:
-                    data = tw_official_data[ticker_code]
-                    last_price = data['price']
-                    change = data['change']
-                    pct_change = data['pct_change']
-                
-                # 【策略 B】國際指數 或 官方 API 沒抓到：使用 yfinance fast_info
-                stock = yf.Ticker(ticker_code)
-                if last_price is None:
-                    try:
-                        fi = stock.fast_info
-                        if fi.last_price is not None and fi.previous_close is not None:
-                            last_price = float(fi.last_price)
-                            prev_close = float(fi.previous_close)
-                            # 簡單防呆，避免昨收為 0
-                            if prev_close > 0:
-                                change = last_price - prev_close
-                                pct_change = (change / prev_close) * 100
-                    except: pass
+def _fast_info_price_volume(ticker):
+    # 單一代號的最新價量；後綴猜錯 (.TW / .TWO) 查無此代號時 yfinance 丟的是資料類例外，
+    # 那是正常的查無資料，回傳 (0, 0) 不算來源失敗；連線錯誤照樣往上丟，由熔斷器計入
+    fi = yf.Ticker(ticker).fast_info
+    try: return fi.get('last_price', 0) or 0, fi.get('last_volume', 0) or 0
+    except (KeyError, ValueError, TypeError, IndexError): return 0, 0
+
+# --- 指數報價補救鏈：官方 MIS -> yfinance fast_info -> 5 日日線 ---
+def _change_from(last_price, prev_close):
+    change = last_price - prev_close if prev_close > 0 else 0
+    pct_change = (change / prev_close) * 100 if prev_close > 0 else 0
+    return last_price, change, pct_change
+
+def _quote_from_fast_info(ticker_code, deadline):
+    # 國際指數 或 官方 API 沒抓到：使用 yfinance fast_info
+    fi = yf.Ticker(ticker_code).fast_info
+    prices = YF_CIRCUIT.call(lambda: (fi.last_price, fi.previous_close))
+    if prices is None or prices[0] is None or prices[1] is None: return None
+    return _change_from(float(prices[0]), float(prices[1]))
+
+def _quote_from_history(ticker_code, deadline):
+    # fast_info 也失效 (雲端偶爾發生)：用最近 5 天日線的最後兩筆收盤
+    df = YF_CIRCUIT.call(yf.Ticker(ticker_code).history, period="5d", timeout=max(deadline.remaining(), 0.5), failed=lambda d: d.empty)
+    if df is None or len(df) < 2: return None
+    last_price, prev_close = float(df['Close'].iloc[-1]), float(df['Close'].iloc[-2])
+    return _change_from(last_price, prev_close) if prev_close > 0 else None
+
+def build_index_quote_provider():
+    """
+    指數報價來源 (IndexQuoteProvider)；由 get_market_refresher 建一份交給背景 thread。
+    同一代號同時只抓一次；半個更新週期內重複詢問拿到同一筆報價。
+    官方 MIS 一次回傳加權與櫃買，兩個代號共用同一個請求。
+    """
+    max_age = MARKET_REFRESH_SECONDS / 2
+    mis = Coalescer(max_age)
 
-                # 3. 準備走勢圖數據 (Trend - Sparkline)
-                # 統一使用 yfinance 抓歷史資料畫圖
-                is_crypto = "-USD" in ticker_code
-                interval = "15m" if is_crypto else "5m"
-                
-                hist_intra = stock.history(period="1d", interval=interval)
-                # 資料不足的補救措施 (例如剛開盤或假日)
-                if hist_intra.empty or len(hist_intra) < 5:
-                    hist_intra = stock.history(period="5d", interval="60m")
-                if hist_intra.empty:
-                    hist_intra = stock.history(period="1mo", interval="1d")
-                
-                trend_data = hist_intra['Close'].dropna().tolist()
-                
-                # 4. 最終防呆
-                # 如果真的完全沒價格，嘗試用走勢圖最後一點 (最後手段)
-                if last_price is None and trend_data:
-                    last_price = trend_data[-1]
-                
-                if last_price is None: continue
+    def quote_from_mis(ticker_code, deadline):
+        # 台灣指數：直接使用官方 API 結果
+        if ticker_code not in ["^TWII", "^TWOII"]: return None
+        data = mis.run('mis', fetch_official_tw_index_data, timeout=deadline.remaining()).get(ticker_code)
+        return (data['price'], data['change'], data['pct_change']) if data else None
 
-                # 5. 格式化輸出
-                color_hex = "#DC2626" if change > 0 else ("#059669" if change < 0 else "#6B7280")
-                
-                market_data.append({
-                    "name": name, 
-                    "price": f"{last_price:,.2f}", 
-                    "change": change, 
-                    "pct_change": pct_change, 
-                    "color_hex": color_hex,
-                    "trend": trend_data
-                })
-                
-            except Exception as e:
-                print(f"Error processing {ticker_code}: {e}")
-                continue
-        return market_data
-    except Exception as e:
-        print(f"Global market data fatal error: {e}")
-        return []		
+    chain = [('MIS', quote_from_mis), ('fast_info', _quote_from_fast_info), ('history', _quote_from_history)]
+    return IndexQuoteProvider(chain, max_age=max_age)
+
+def fetch_market_price(provider, ticker_code, deadline):
+    """
+    單一指數的價格；在 thread pool 裡執行
+    Returns:
+        (last_price, change, pct_change) 或 None (補救鏈都沒抓到)
+    """
+    quote = provider.get(ticker_code, deadline)
+    return (quote.price, quote.change, quote.pct_change) if quote else None
+
+def _batch_closes(tickers, period, interval, deadline):
+    # 多檔一次下載，回傳 {ticker: 收盤價 Series (已去掉 NaN)}
+    if not tickers or deadline.expired(): return {}
+    data = YF_CIRCUIT.call(
+        yf.download, tickers, period=period, interval=interval, group_by='ticker', progress=False, threads=True,
+        timeout=max(deadline.remaining(), 0.5), failed=lambda d: d is None or d.empty
+    )
+    closes = {}
+    if data is None or data.empty: return closes
+    for ticker in tickers:
+        if isinstance(data.columns, pd.MultiIndex) and ticker in data.columns.levels[0]:
+            closes[ticker] = data[ticker]['Close'].dropna()
+    return closes
+
+def fetch_market_trends(tickers, deadline):
+    """
+    所有指數的走勢圖 (Sparkline) 一次批次下載：先全部抓 1d/5m (加密貨幣再壓成 15 分線)，
+    筆數不足的才補抓 5d/60m，還是沒有的再補 1mo/1d (補救也是批次)。
+    Returns:
+        {ticker: [收盤價, ...]}；一檔都沒抓到時回傳 None (保留上一次成功的走勢圖)
+    """
+    closes = _batch_closes(tickers, "1d", "5m", deadline)
+    for ticker, series in closes.items():
+        if "-USD" in ticker and not series.empty:
+            closes[ticker] = series.resample("15min").last().dropna()
+    # 資料不足的補救措施 (例如剛開盤或假日)
+    short = [t for t in tickers if len(closes.get(t, ())) < 5]
+    closes.update({t: c for t, c in _batch_closes(short, "5d", "60m", deadline).items() if not c.empty})
+    empty = [t for t in tickers if len(closes.get(t, ())) == 0]
+    closes.update({t: c for t, c in _batch_closes(empty, "1mo", "1d", deadline).items() if not c.empty})
+    return {t: closes[t].tolist() for t in tickers if t in closes} or None
+
+def _refresh_market_snapshot(provider, last_good):
+    # 背景 thread 每一輪做的事：8 個指數的價格 + 一次批次下載的走勢圖 + 台股官方 API 同時抓 (共用 thread pool)，
+    # 最多等 FETCH_BUDGET 秒；逾時或失敗的項目用 last_good (上一次成功的資料) 補上
+    pool = shared_pool()
+    # 台股官方資料只抓一次：加權 / 櫃買兩個工作透過同一個 provider 共用同一個 MIS 請求
+    tasks = {
+        ticker_code: (lambda deadline, t=ticker_code: fetch_market_price(provider, t, deadline))
+        for ticker_code in GLOBAL_MARKET_INDICES
+    }
+    tasks['trend'] = lambda deadline: fetch_market_trends(list(GLOBAL_MARKET_INDICES), deadline)
+    results, status = fetch_all(tasks, budget=FETCH_BUDGET, last_good=last_good, pool=pool)
+    late = [t for t, state in status.items() if state != 'ok']
+    if late: print(f"Global market fetch: {', '.join(f'{t}={status[t]}' for t in late)}")
+    
+    trends = results.get('trend', {})
+    market_data = []
+    for ticker_code, name in GLOBAL_MARKET_INDICES.items():
+        trend_data = trends.get(ticker_code, [])
+        if ticker_code in results:
+            last_price, change, pct_change = results[ticker_code]
+        elif trend_data:
+            # 如果真的完全沒價格，嘗試用走勢圖最後一點 (最後手段)
+            last_price, change, pct_change = trend_data[-1], 0, 0
+        else:
+            continue
+        
+        color_hex = "#DC2626" if change > 0 else ("#059669" if change < 0 else "#6B7280")
+        market_data.append({
+            "name": name, 
+            "price": f"{last_price:,.2f}", 
+            "change": change, 
+            "pct_change": pct_change, 
+            "color_hex": color_hex,
+            "trend": trend_data
+        })
+    
+    # 儀表板用的加權 / 櫃買報價 (沒抓到時價格為 0)
+    quotes = {}
+    for ticker_code in ["^TWII", "^TWOII"]:
+        price, change, pct_change = results.get(ticker_code, (0.0, 0.0, 0.0))
+        quotes[ticker_code] = {'price': price, 'change': change, 'pct_change': pct_change}
+    return {'cards': market_data, 'quotes': quotes}, status
+
+@st.cache_resource(on_release=lambda refresher: refresher.stop())
+def get_market_refresher():
+    # 整個 process 只有一個背景 thread 負責抓報價，每 MARKET_REFRESH_SECONDS 秒發布一份新的快照。
+    # 背景 thread 沒有 ScriptRunContext，不能碰 st.cache_*：報價來源與最後成功值在這裡建好，由 closure 帶進去。
+    # 快取被清掉 (Clear cache) 時 on_release 停掉舊 thread，下一次呼叫再建新的
+    provider, last_good = build_index_quote_provider(), LastGood()
+    return BackgroundRefresher(lambda: _refresh_market_snapshot(provider, last_good), MARKET_REFRESH_SECONDS, name='kite-market').start()
+
+def get_market_snapshot():
+    """最新的報價快照 (Snapshot，唯讀)；背景第一輪還沒抓完時回傳 None。不會等網路。"""
+    return get_market_refresher().latest()
+
+def get_global_market_data_with_chart():
+    snapshot = get_market_snapshot()
+    return list(snapshot.data['cards']) if snapshot else []
+
+def get_index_quote(ticker_code):
+    """加權 (^TWII) / 櫃買 (^TWOII) 的最新報價 {'price', 'change', 'pct_change'}，沒有資料時價格為 0"""
+    snapshot = get_market_snapshot()
+    if snapshot and ticker_code in snapshot.data['quotes']: return dict(snapshot.data['quotes'][ticker_code])
+    return {'price': 0.0, 'change': 0.0, 'pct_change': 0.0}
 
 # --- 恐懼與貪婪指數 (V154: 結構相容修復版) ---
 @st.cache_data(ttl=300) 
@@ -667,7 +754,8 @@ def get_cnn_fear_greed_full():
         "Pragma": "no-cache"
     }
     try:
-        r = requests.get(url, headers=headers, timeout=10)
+        r = CNN_CIRCUIT.call(requests.get, url, headers=headers, timeout=10, failed=_http_failed)
+        if r is None: return {"error": "CNN 連線暫停中 (連續失敗，稍後自動重試)"}
         if r.status_code == 200:
             data = r.json()
             
@@ -900,6 +988,8 @@ def render_global_markets():
         st.info("⏳ 市場資料讀取中...")
         st.divider()
         return
+    snapshot = get_market_snapshot()
+    st.caption(f"報價更新於 {datetime.fromtimestamp(snapshot.fetched_at, tz=pytz.timezone('Asia/Taipei')).strftime('%H:%M:%S')} (背景每 {MARKET_REFRESH_SECONDS} 秒更新)")
 
     # --- 1. 產生卡片 HTML ---
     cards_list = []
@@ -1073,8 +1163,8 @@ def get_yahoo_realtime_rank(limit=20):
         ]
         all_data = []
         for url, market in urls:
-            r = requests.get(url, headers=headers, timeout=10)
-            if r.status_code == 200:
+            r = YAHOO_RANK_CIRCUIT.call(requests.get, url, headers=headers, timeout=10, failed=_http_failed)
+            if r is not None and r.status_code == 200:
                 dfs = pd.read_html(io.StringIO(r.text))
                 target_df = None
                 for df in dfs:
@@ -1093,17 +1183,17 @@ def get_yahoo_realtime_rank(limit=20):
                             tokens = raw_str.split(' ')
                             code = tokens[0]
                             name = tokens[1] if len(tokens) > 1 else code
-                            _, _, sector = smart_get_code_and_sector(name)
                             price = float(re.sub(r"[^\d.]", "", str(row.iloc[price_idx])))
                             turnover = float(re.sub(r"[^\d.]", "", str(row.iloc[turnover_idx])))
                             change_str = str(row.iloc[change_idx])
                             if "▼" in change_str or "-" in change_str: change = -abs(float(re.sub(r"[^\d.]", "", change_str)))
                             else: change = abs(float(re.sub(r"[^\d.]", "", change_str)))
                             if turnover > 0:
-                                all_data.append({"代號": code, "名稱": name, "股價": price, "漲跌幅%": change, "成交值(億)": turnover, "市場": market, "族群": sector, "來源": "Yahoo"})
+                                all_data.append({"代號": code, "名稱": name, "股價": price, "漲跌幅%": change, "成交值(億)": turnover, "市場": market, "族群": None, "來源": "Yahoo"})
                         except: continue
         if all_data:
             df = pd.DataFrame(all_data)
+            df['族群'] = SYMBOLS.resolve_many(df['名稱'])[2] # 整欄一次查族群
             df = df.sort_values(by="成交值(億)", ascending=False).reset_index(drop=True)
             df.index = df.index + 1
             df.insert(0, '排名', df.index)
@@ -1111,9 +1201,10 @@ def get_yahoo_realtime_rank(limit=20):
     except: pass
     
     # 備援：yfinance (V139 保底)
-    tickers = [f"{c}.TW" for c in MASTER_STOCK_DB.keys()] + [f"{c}.TWO" for c in MASTER_STOCK_DB.keys()]
+    tickers = [t for c in MASTER_STOCK_DB.keys() for t in SYMBOLS.tickers(c)]
     try:
-        data = yf.download(tickers, period="1d", group_by='ticker', progress=False, threads=False)
+        data = YF_STOCK_CIRCUIT.call(yf.download, tickers, period="1d", group_by='ticker', progress=False, threads=False, failed=lambda d: d is None or d.empty)
+        if data is None: return pd.DataFrame()
         yf_list = []
         for ticker in tickers:
             try:
@@ -1134,12 +1225,12 @@ def get_yahoo_realtime_rank(limit=20):
                 if turnover < 1: continue 
                 op = latest['Open']
                 chg = ((price - op)/op)*100 if op > 0 else 0
-                _, name, sector = smart_get_code_and_sector(code)
                 market = "上櫃" if ".TWO" in ticker else "上市"
-                yf_list.append({"代號": code, "名稱": name, "股價": round(float(price),2), "漲跌幅%": round(float(chg),2), "成交值(億)": round(float(turnover),2), "市場": market, "族群": sector, "來源": "YahooFinance"})
+                yf_list.append({"代號": code, "名稱": None, "股價": round(float(price),2), "漲跌幅%": round(float(chg),2), "成交值(億)": round(float(turnover),2), "市場": market, "族群": None, "來源": "YahooFinance"})
             except: continue
         if yf_list:
             df = pd.DataFrame(yf_list)
+            _, df['名稱'], df['族群'] = SYMBOLS.resolve_many(df['代號'])
             df = df.sort_values(by="成交值(億)", ascending=False).reset_index(drop=True)
             df.index = df.index + 1
             df.insert(0, '排名', df.index)
@@ -1159,7 +1250,8 @@ def plot_market_index(index_type='上市', period='6mo'):
     
     try:
         stock = yf.Ticker(ticker)
-        df = stock.history(period=period)
+        df = YF_CIRCUIT.call(stock.history, period=period, failed=lambda d: d.empty)
+        if df is None: return None, f"yfinance 連線暫停中，暫時無法取得 {index_type} 指數資料"
         if df.empty: return None, f"無法取得 {index_type} 指數資料"
         
         # 計算均線
@@ -1231,7 +1323,8 @@ def render_trend_card(col, title, desc, bg_class, icon):
     </div>
     """, unsafe_allow_html=True)
 
-def render_stock_tags_v113(stock_str, turnover_map):
+def render_stock_tags_v113(stock_str, turnover_map, codes=None):
+    # codes: DayView['codes'] (標籤名稱 -> 代號)，有給就不必再逐一查代號
     if pd.isna(stock_str) or not stock_str: return "<span style='color:#bdc3c7; font-size:1.2rem; font-weight:600;'>（無標的）</span>"
     stock_names = [s.strip() for s in str(stock_str).split('、') if s.strip()]
     html = ""
@@ -1243,7 +1336,7 @@ def render_stock_tags_v113(stock_str, turnover_map):
             t_str = f"<span class='turnover-val'>💰 {turnover_map[clean_s]:.1f}億</span>"
         else:
             # 2. 查代碼
-            code = smart_get_code(clean_s)
+            code = codes.get(clean_s) if codes is not None and clean_s in codes else smart_get_code(clean_s)
             if code and code in turnover_map:
                  t_str = f"<span class='turnover-val'>💰 {turnover_map[code]:.1f}億</span>"
         
@@ -1251,53 +1344,146 @@ def render_stock_tags_v113(stock_str, turnover_map):
         else: html += f"<div class='stock-tag'>{clean_s}{t_str}</div>"
     return html
 
-def load_db():
-    if os.path.exists(DB_FILE):
+# 同一個 process 內的存檔互斥：寫入前後的寫入次數才對得上這次寫入 (索引同步用)
+_SAVE_LOCK = threading.Lock()
+
+def get_db_store():
+    store = MonthPartitionedStore(DB_STORE_DIR)
+    # 一次性搬移：舊版只有 CSV 時，第一次讀取就轉成分月 Parquet
+    if not store.exists() and os.path.exists(DB_FILE):
+        try: migrate_csv_to_store(DB_FILE, DB_STORE_DIR)
+        except Exception as e: print(f"DB Migrate Error: {e}")
+    return store
+
+def get_db_index():
+    index = KiteSqliteStore(DB_SQLITE_FILE, resolve=smart_get_code_and_sector, signature=SYMBOLS.signature)
+    # 索引記錄的寫入次數與分月資料庫對不上 (第一次使用、索引檔遺失、上次存檔時索引寫入失敗...) 就整份重建
+    writes = get_db_store().write_count()
+    if index.synced_writes() != writes:
+        index.replace_all(load_db(), synced=writes)
+    return index
+
+def get_db_backup():
+    # 每次存檔只備份有變動的日期；第一次使用時先把目前資料庫存成基準還原點
+    journal = BackupJournal(DB_BACKUP_DIR)
+    try: journal.ensure_baseline(load_db())
+    except Exception as e: print(f"Backup Error: {e}")
+    return journal
+
+# --- 共用讀檔快取：以 (路徑, mtime, size) 為 key，整個 process 共用同一份解析結果 ---
+# 存檔後檔案指紋改變就會自動讀到新資料；回傳淺拷貝 (Copy-on-Write)，呼叫端新增欄位不會影響共用資料
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _load_db_shared(store_fingerprint, columns, months):
+    store = MonthPartitionedStore(DB_STORE_DIR)
+    df = store.read(columns=list(columns) if columns is not None else None, months=list(months) if months is not None else None)
+    
+    # 數字欄位在 Parquet 裡已經是整數，這裡只補齊舊分區可能缺少的欄位
+    for col in NUMERIC_COLS:
+        if col in df.columns:
+            df[col] = df[col].fillna(0).astype(int)
+    
+    # V150 Fix: 即使舊資料沒有 'manual_turnover' 欄位，也強制在記憶體中建立
+    if columns is None or 'manual_turnover' in columns:
+        if 'manual_turnover' not in df.columns:
+            df['manual_turnover'] = ""
+        df['manual_turnover'] = df['manual_turnover'].fillna('').astype(str).replace('nan', '')
+    
+    return df
+
+def load_db(columns=None, months=None):
+    """
+    columns: 只讀取指定欄位 (None = 全部)
+    months: 只讀取指定月份 e.g. ['2025-12'] (None = 全部)
+    """
+    store = get_db_store()
+    if store.exists():
         try:
-            df = pd.read_csv(DB_FILE, encoding='utf-8-sig')
-            
-            # 處理數字欄位
-            numeric_cols = ['part_time_count', 'worker_strong_count', 'worker_trend_count']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
-            
-            # V150 Fix: 即使 CSV 檔沒有 'manual_turnover' 欄位 (雲端舊檔)，也強制在記憶體中建立
-            if 'manual_turnover' not in df.columns:
-                df['manual_turnover'] = ""
-            
-            # V150 Fix: 強制轉型，避免編輯器報錯
-            df['manual_turnover'] = df['manual_turnover'].astype(str).replace('nan', '')
-                
-            if 'date' in df.columns:
-                df['date'] = df['date'].astype(str)
-                return df.sort_values('date', ascending=False)
+            cols_key = tuple(columns) if columns is not None else None
+            months_key = tuple(months) if months is not None else None
+            return _load_db_shared(store.fingerprint(), cols_key, months_key).copy(deep=False)
+        except Exception as e:
+            print(f"Load DB Error: {e}")
+            return pd.DataFrame()
+    return pd.DataFrame()
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _load_frame_shared(store_fingerprint):
+    return canonical_frame(_load_db_shared(store_fingerprint, None, None))
+
+def load_frame():
+    """儀表板用的標準表 (dt index、分類型風度、compare_date / Month 已算好)，請當唯讀使用"""
+    store = get_db_store()
+    if store.exists():
+        try: return _load_frame_shared(store.fingerprint()).copy(deep=False)
         except Exception as e:
             print(f"Load DB Error: {e}")
             return pd.DataFrame()
     return pd.DataFrame()
 
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _load_day_views_shared(store_fingerprint):
+    return build_day_views(_load_frame_shared(store_fingerprint), resolve=smart_get_code_and_sector)
+
+def load_day_views():
+    """{'YYYY-MM-DD': DayView}：每一天的風度、連續天數、風箏數、選股(含代號)，所有 session 共用，請當唯讀使用"""
+    store = get_db_store()
+    if store.exists():
+        try: return _load_day_views_shared(store.fingerprint())
+        except Exception as e:
+            print(f"Load DB Error: {e}")
+            return {}
+    return {}
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _load_presence_shared(store_fingerprint):
+    return PresenceMatrix.from_frame(_load_frame_shared(store_fingerprint))
+
+def load_presence():
+    """日期 × 策略 × 股票 的出現矩陣 (PresenceMatrix)，所有 session 共用，請當唯讀使用"""
+    store = get_db_store()
+    if store.exists():
+        try: return _load_presence_shared(store.fingerprint())
+        except Exception as e: print(f"Load DB Error: {e}")
+    return PresenceMatrix.from_frame(pd.DataFrame())
+
+def invalidate_db_cache():
+    _load_db_shared.clear()
+    _load_frame_shared.clear()
+    _load_day_views_shared.clear()
+    _load_presence_shared.clear()
+
 # V158: 新增歷史資料讀取函數
 # --- 【修改】加入 file_path 參數，預設為櫃買 ---
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _load_history_shared(file_path, fingerprint):
+    # 讀 .npy 唯讀映射快取 (kite_history_npy/)；快取不存在或 CSV 被換過時會自動重建
+    try:
+        arrays, meta = load_history_arrays(file_path)
+        return history_frame(arrays, meta)
+    except Exception as e:
+        print(f"Load History Cache Error ({file_path}): {e}")
+    # 快取建不起來 (目錄不可寫、磁碟滿...)：直接解析 CSV，欄位與快取版相同
+    # CSV 也讀不到時例外直接往外丟，失敗結果不會被快取 (檔案修好後下一次 rerun 就讀得到)
+    return history_frame(*history_arrays_from_frame(read_history_csv(file_path)))
+
 def load_history_data(file_path=HISTORY_FILE_TPEX):
-    if os.path.exists(file_path):
-        try:
-            df = pd.read_csv(file_path)
-            # 簡單檢查欄位
-            if '日期' in df.columns and '風度' in df.columns:
-                # 處理日期格式 YYYY.MM.DD
-                df['日期'] = pd.to_datetime(df['日期'], format='%Y.%m.%d', errors='coerce')
-                df = df.dropna(subset=['日期']).sort_values('日期')
-                return df
-        except Exception as e:
-            print(f"Load History Error ({file_path}): {e}")
+    try: return _load_history_shared(file_path, file_fingerprint(file_path)).copy(deep=False)
+    except Exception as e: print(f"Load History Error ({file_path}): {e}")
     return pd.DataFrame()
 
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _load_wind_runs_shared(file_path, fingerprint):
+    hist_df = _load_history_shared(file_path, fingerprint)
+    if hist_df.empty or '風度' not in hist_df.columns: return None
+    return WindRuns(hist_df['日期'], hist_df['風度'])
+
+def load_wind_runs(file_path=HISTORY_FILE_TPEX):
+    """歷史檔風度的 run-length 編碼 (WindRuns)，檔案沒換就共用同一份；沒有資料時回傳 None"""
+    try: return _load_wind_runs_shared(file_path, file_fingerprint(file_path))
+    except Exception as e: print(f"Load History Error ({file_path}): {e}")
+    return None
+
 def save_batch_data(records_list):
-    df = load_db()
-    if os.path.exists(DB_FILE):
-        try: shutil.copy(DB_FILE, BACKUP_FILE)
-        except: pass
     if isinstance(records_list, list): new_data = pd.DataFrame(records_list)
     else: new_data = records_list
     
@@ -1306,72 +1492,55 @@ def save_batch_data(records_list):
         # V143: 新資料也要確保有欄位
         if 'manual_turnover' not in new_data.columns:
             new_data['manual_turnover'] = ""
-            
-        if not df.empty:
-            df = df[~df['date'].isin(new_data['date'])]
-            df = pd.concat([df, new_data], ignore_index=True)
-        else: df = new_data
-    df = df.sort_values('date', ascending=False)
-    df.to_csv(DB_FILE, index=False, encoding='utf-8-sig')
-    return df
+        # 只附加新資料到更新紀錄，累積夠多再於背景整併回分月檔
+        journal = get_db_backup()
+        # 先讓索引追上資料庫；失敗只記錄，選股照樣寫進資料庫 (同步點沒前進，下次 get_db_index 會再重建)
+        try: index = get_db_index()
+        except Exception as e:
+            index = None
+            print(f"DB Index Error: {e}")
+        with _SAVE_LOCK:
+            store = get_db_store()
+            before = store.write_count()
+            store.upsert(new_data)
+            after = store.write_count()
+        try: journal.record_upsert(new_data)
+        except Exception as e: print(f"Backup Error: {e}")
+        # 索引寫入失敗時同步點不會前進，下次 get_db_index 會由資料庫重建
+        if index is not None:
+            try: index.upsert_days(new_data, synced=(before, after))
+            except Exception as e: print(f"DB Index Error: {e}")
+        invalidate_db_cache()
+    return load_db()
 
 def save_full_history(df_to_save):
     if not df_to_save.empty:
         df_to_save['date'] = df_to_save['date'].astype(str)
-        df_to_save = df_to_save.sort_values('date', ascending=False)
-        df_to_save.to_csv(DB_FILE, index=False, encoding='utf-8-sig')
+        journal = get_db_backup()
+        with _SAVE_LOCK:
+            store = get_db_store()
+            store.write_all(df_to_save)
+            writes = store.write_count()
+        try: journal.record_replace(df_to_save)
+        except Exception as e: print(f"Backup Error: {e}")
+        try: KiteSqliteStore(DB_SQLITE_FILE, resolve=smart_get_code_and_sector, signature=SYMBOLS.signature).replace_all(df_to_save, synced=writes)
+        except Exception as e: print(f"DB Index Error: {e}")
+        invalidate_db_cache()
+
+def compact_db():
+    merged_months = get_db_store().compact()
+    invalidate_db_cache()
+    return merged_months
 
 def clear_db():
+    # 備份日誌保留，清空後仍可從還原點救回
+    journal = get_db_backup()
+    get_db_store().clear()
+    try: journal.record_clear()
+    except Exception as e: print(f"Backup Error: {e}")
+    KiteSqliteStore(DB_SQLITE_FILE).clear()
     if os.path.exists(DB_FILE): os.remove(DB_FILE)
-
-def calculate_wind_streak(df, current_date_str):
-    if df.empty: return 0
-    past_df = df[df['date'] <= current_date_str].copy()
-    if past_df.empty: return 0
-    past_df = past_df.sort_values('date', ascending=False).reset_index(drop=True)
-    def clean_wind(w): return str(w).replace("(CB)", "").strip()
-    current_wind = clean_wind(past_df.iloc[0]['wind'])
-    streak = 1
-    for i in range(1, len(past_df)):
-        prev_wind = clean_wind(past_df.iloc[i]['wind'])
-        if prev_wind == current_wind: streak += 1
-        else: break
-    return streak
-
-def calculate_monthly_stats(df):
-    if df.empty: return pd.DataFrame()
-    df['dt'] = pd.to_datetime(df['date'], errors='coerce')
-    df['Month'] = df['dt'].dt.strftime('%Y-%m')
-    strategies = {
-        '🔥 強勢週': 'worker_strong_list', '📈 週趨勢': 'worker_trend_list',
-        '↩️ 週拉回': 'boss_pullback_list', '🏷️ 廉價收購': 'boss_bargain_list',
-        '💰 營收 TOP6': 'top_revenue_list'
-    }
-    all_stats = []
-    for strategy_name, col_name in strategies.items():
-        if col_name not in df.columns: continue
-        temp = df[['Month', col_name]].copy()
-        temp[col_name] = temp[col_name].astype(str)
-        temp = temp[temp[col_name].notna() & (temp[col_name] != 'nan') & (temp[col_name] != '')]
-        temp['stock'] = temp[col_name].str.split('、')
-        exploded = temp.explode('stock')
-        exploded['stock'] = exploded['stock'].str.strip()
-        exploded = exploded[exploded['stock'] != '']
-        counts = exploded.groupby(['Month', 'stock']).size().reset_index(name='Count')
-        counts['Strategy'] = strategy_name
-        
-        # 【V132】Robust Lookup
-        def find_sector(stock_name):
-            _, _, sector = smart_get_code_and_sector(stock_name)
-            return sector
-            
-        counts['Industry'] = counts['stock'].apply(find_sector)
-        all_stats.append(counts)
-        
-    if not all_stats: return pd.DataFrame()
-    final_df = pd.concat(all_stats)
-    final_df = final_df.sort_values(['Month', 'Strategy', 'Count'], ascending=[False, True, False])
-    return final_df
+    invalidate_db_cache()
 
 import math
 import plotly.graph_objects as go
@@ -1635,66 +1804,72 @@ def ai_analyze_v86(image):
     except Exception as e: return json.dumps({"error": str(e)})
 
 
-# --- [V2.2] 強壯版櫃買指數獲取 (官方 API -> YF Fast -> YF History) ---
-def get_tpex_robust():
-    # 初始化預設值
-    tpex_data = {'price': 0.0, 'change': 0.0, 'pct_change': 0.0}
-    
-    # ---------------------------------------
-    # 策略 1: 官方 API (最準，但雲端易被擋)
-    # ---------------------------------------
-    try:
-        official_data = fetch_official_tw_index_data()
-        if "^TWOII" in official_data:
-            # 檢查數據是否有效 (非 0)
-            if official_data["^TWOII"]['price'] > 0:
-                return official_data["^TWOII"]
-    except Exception:
-        pass
-
-    # ---------------------------------------
-    # 策略 2: Yahoo Finance (終極備援)
-    # ---------------------------------------
-    try:
-        # 使用 ^TWOII (櫃買指數代號)
-        ticker = yf.Ticker("^TWOII")
-        
-        # 【關鍵修正】改用 history 抓取最近 5 天資料
-        # fast_info 在雲端有時會失效，但 history 幾乎都能拿到表格
-        df = ticker.history(period="5d")
-        
-        if not df.empty:
-            # 取得最後一筆收盤價 (即時價或昨日收盤)
-            last_price = float(df['Close'].iloc[-1])
-            
-            # 嘗試取得前一筆收盤價來計算漲跌
-            if len(df) >= 2:
-                prev_close = float(df['Close'].iloc[-2])
-            else:
-                # 如果只有一筆資料，嘗試從 info 抓昨收，若無則設為相同
-                prev_close = ticker.info.get('previousClose', last_price)
-            
-            # 防止昨收為 0
-            if prev_close <= 0: prev_close = last_price
-
-            change = last_price - prev_close
-            pct_change = (change / prev_close) * 100
-            
-            tpex_data = {
-                'price': last_price,
-                'change': change,
-                'pct_change': pct_change
-            }
-            return tpex_data
-            
-    except Exception as e:
-        print(f"TPEx Fallback Error: {e}")
-
-    return tpex_data
-
-# ---計算指定月份的個股平均成交值
+# --- 每日成交值表 (畫面上列出的股票，資料庫整段期間一次下載) + 前綴和：任意區間的日均成交都是兩個前綴相減 ---
+def _download_daily_turnover(stock_names, start_date, end_date):
+    """
+    批次下載每日成交值 (收盤價 * 成交量 / 1億)
+    Returns:
+        DataFrame: index = 交易日，columns = 股票名稱，沒有資料為 NaN
+    """
+    code_map = {} # {code: name}
+    tickers = []
+    for name in set(stock_names):
+        code, _, _ = smart_get_code_and_sector(name)
+        if code:
+            tickers.extend(SYMBOLS.tickers(code))
+            code_map[code] = name # 用代碼反查名稱
+    if not tickers: return pd.DataFrame()
+
+    data = YF_STOCK_CIRCUIT.call(yf.download, tickers, start=start_date, end=end_date, group_by='ticker', progress=False, threads=True, failed=lambda d: d is None or d.empty)
+    if data is None: return pd.DataFrame()
+    columns = {}
+    for code, name in code_map.items():
+        # 主檔知道上市/上櫃時只有一個 ticker，否則兩個都試
+        for ticker in SYMBOLS.tickers(code):
+            try:
+                if isinstance(data.columns, pd.MultiIndex) and ticker in data.columns.levels[0]:
+                    df = data[ticker]
+                elif len(tickers) == 1: # 只有一檔時 yfinance 結構不同
+                    df = data
+                else:
+                    continue
+                df = df.dropna(subset=['Close', 'Volume'])
+                daily_turnover = (df['Close'] * df['Volume']) / 100000000
+                if (daily_turnover > 0).any():
+                    columns[name] = daily_turnover
+                    break
+            except: pass
+    if not columns: return pd.DataFrame()
+    daily = pd.DataFrame(columns)
+    daily.index = pd.DatetimeIndex(daily.index).tz_localize(None).normalize()
+    return daily
+
+# key 是 (排序過的股票清單, 資料庫期間)：同一組股票換區間只是切不同的前綴，ttl 內不必重新下載
+@st.cache_resource(ttl=600, max_entries=16, show_spinner=False)
+def _load_turnover_prefix_shared(stock_names, start_date, end_date):
+    daily = pd.DataFrame()
+    try: daily = _download_daily_turnover(list(stock_names), start_date, end_date)
+    except Exception as e: print(f"Error fetching daily turnover: {e}")
+    return TurnoverPrefix(daily)
+
+def load_turnover_prefix(stock_names):
+    """指定股票在資料庫期間內的每日成交值前綴和 (TurnoverPrefix)；名稱可含 (CB)，與不含的視為同一檔"""
+    presence = load_presence()
+    if not len(presence.dates): return TurnoverPrefix(pd.DataFrame())
+    names = tuple(sorted({base_name(n) for n in stock_names}))
+    start_date = presence.dates[0].replace(day=1).strftime('%Y-%m-%d')
+    end_date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d') # yfinance 的 end 不含當天
+    return _load_turnover_prefix_shared(names, start_date, end_date)
+
+def get_range_avg_turnover(stock_names, start_date, end_date):
+    """
+    計算任意區間 (含頭尾) 的個股日均成交值
+    Returns:
+        Dict: { '股票名稱': 平均成交值(億) }
+    """
+    if len(stock_names) == 0: return {}
+    return load_turnover_prefix(stock_names).average(stock_names, start_date, end_date)
 
-@st.cache_data(ttl=300)
 def get_monthly_avg_turnover(stock_names, month_str):
     """
     計算指定月份的個股平均成交值
@@ -1704,81 +1879,30 @@ def get_monthly_avg_turnover(stock_names, month_str):
     Returns:
         Dict: { '股票名稱': 平均成交值(億) }
     """
-    if not stock_names: return {}
-    
-    # 1. 解析日期範圍
-    try:
-        dt = datetime.strptime(month_str, '%Y-%m')
-        start_date = dt.strftime('%Y-%m-%d')
-        # 計算下個月的第一天作為結束日期
-        if dt.month == 12:
-            end_date = datetime(dt.year + 1, 1, 1).strftime('%Y-%m-%d')
-        else:
-            end_date = datetime(dt.year, dt.month + 1, 1).strftime('%Y-%m-%d')
-    except:
-        return {}
-
-    # 2. 轉換名稱為代碼
-    code_map = {} # {code: name}
-    tickers = []
-    unique_names = list(set(stock_names))
-    
-    for name in unique_names:
-        # 假設 smart_get_code_and_sector 已經在您的程式碼中定義
-        code, _, _ = smart_get_code_and_sector(name)
-        if code:
-            tickers.append(f"{code}.TW")
-            tickers.append(f"{code}.TWO")
-            code_map[code] = name # 用代碼反查名稱
-
-    if not tickers: return {}
-
-    # 3. 批次下載歷史資料 (加速)
-    try:
-        data = yf.download(tickers, start=start_date, end=end_date, group_by='ticker', progress=False, threads=True)
-        result = {}
-        
-        for code, name in code_map.items():
-            avg_val = 0
-            # 嘗試上市或上櫃
-            for suffix in ['.TW', '.TWO']:
-                ticker = f"{code}{suffix}"
-                try:
-                    if isinstance(data.columns, pd.MultiIndex) and ticker in data.columns.levels[0]:
-                        df = data[ticker]
-                    elif len(tickers) == 1: # 只有一檔時 yfinance 結構不同
-                        df = data
-                    else:
-                        continue
-
-                    if not df.empty:
-                        # 計算每日成交值 = 收盤價 * 成交量 / 1億
-                        # 處理可能的 NaN
-                        df = df.dropna(subset=['Close', 'Volume'])
-                        if not df.empty:
-                            daily_turnover = (df['Close'] * df['Volume']) / 100000000
-                            avg_val = daily_turnover.mean()
-                            if avg_val > 0: break 
-                except: pass
-            
-            # 儲存結果 (保留一位小數)
-            if avg_val > 0:
-                result[name] = round(avg_val, 1)
-            else:
-                result[name] = 0.0
-                
-        return result
-    except Exception as e:
-        print(f"Error fetching monthly turnover: {e}")
-        return {}
+    try: month_start = pd.Timestamp(f"{month_str}-01")
+    except ValueError: return {}
+    month_end = month_start + pd.offsets.MonthEnd(0)
+    return get_range_avg_turnover(stock_names, month_start, month_end)
 
 # --- 【新增】共用的循環分析渲染函式 ---
-def render_cycle_analysis_ui(hist_df, index_name="上櫃指數"):
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _load_cycle_shared(file_path, fingerprint):
+    # 循環分段只跟歷史檔內容有關：檔案沒換就共用同一份結果 (調整槓桿不會重算)
+    return segment_cycles(_load_history_shared(file_path, fingerprint))
+
+def load_cycle_analysis(file_path=HISTORY_FILE_TPEX):
+    """歷史檔的循環分析結果 (segment_cycles)，沒有資料時回傳 None；請當唯讀使用"""
+    try: return _load_cycle_shared(file_path, file_fingerprint(file_path))
+    except Exception as e: print(f"Load History Error ({file_path}): {e}")
+    return None
+
+def render_cycle_analysis_ui(file_path, index_name="上櫃指數"):
     """
-    hist_df: 歷史資料 DataFrame
+    file_path: 歷史檔路徑 (HISTORY_FILE_TPEX / HISTORY_FILE_TAIEX)
     index_name: 指數名稱 (用於圖表標題)
     """
-    if hist_df.empty:
+    analysis = load_cycle_analysis(file_path)
+    if analysis is None:
         st.warning(f"⚠️ 尚無 {index_name} 的歷史資料，請至後台上傳 CSV。")
         return
 
@@ -1789,71 +1913,26 @@ def render_cycle_analysis_ui(hist_df, index_name="上櫃指數"):
         # 使用 unique key 避免元件 ID 衝突
         leverage = st.number_input("⚖️ 操作槓桿倍數", min_value=0.1, max_value=10.0, value=1.0, step=0.1, key=f"lev_{index_name}")
     
-    # --- 資料處理 (維持原本邏輯) ---
-    hist_df['日期'] = pd.to_datetime(hist_df['日期'], format='mixed', errors='coerce')
-    hist_df = hist_df.sort_values('日期', ascending=True).reset_index(drop=True)
-    
+    # --- 資料處理 (分段與報酬已預先算好，這裡只取用；槓桿直接乘在平均報酬上) ---
+    hist_df = analysis['frame']
+    zones = analysis['zones']
     min_date = hist_df['日期'].iloc[0]
     max_date = hist_df['日期'].iloc[-1] 
 
-    hist_df['wind_clean'] = hist_df['風度'].fillna('').astype(str).str.strip()
-
-    col_20ma = next((c for c in hist_df.columns if '20ma' in c.lower().replace(' ', '')), None)
-    # 若沒有 20MA 欄位則自動計算
-    hist_df['MA20'] = pd.to_numeric(hist_df[col_20ma], errors='coerce') if col_20ma else hist_df['收'].rolling(window=20, min_periods=1).mean()
-    
-    target_col = next((c for c in hist_df.columns if '行情' in c or '方向' in c), None)
-    
-    if target_col:
-        hist_df[target_col] = hist_df[target_col].astype(str).str.strip()
-        def get_cycle_v179(val):
-            if '強風' in val and '亂流' in val: return 'active'
-            if '無風' in val and '陣風' in val: return 'passive'
-            return 'transition'
-        hist_df['cycle'] = hist_df[target_col].apply(get_cycle_v179)
-    else:
-        hist_df['cycle'] = hist_df['wind_clean'].apply(
-            lambda w: 'active' if ('強風' in w or '亂流' in w) and not ('無風' in w or '陣風' in w) else 
-                        ('passive' if ('無風' in w or '陣風' in w) and not ('強風' in w or '亂流' in w) else 'transition')
-        )
-
     # --- 統計計算 ---
-    d_act = len(hist_df[hist_df['cycle'] == 'active'])
-    d_pass = len(hist_df[hist_df['cycle'] == 'passive'])
-    d_tran = len(hist_df[hist_df['cycle'] == 'transition'])
+    d_act, d_pass, d_tran = analysis['days']['active'], analysis['days']['passive'], analysis['days']['transition']
     total_days = len(hist_df)
     
     p_act = (d_act / total_days * 100) if total_days > 0 else 0
     p_pass = (d_pass / total_days * 100) if total_days > 0 else 0
     p_tran = (d_tran / total_days * 100) if total_days > 0 else 0
 
-    cnt_strong = hist_df['wind_clean'].str.contains('強風').sum()
-    cnt_chaos = hist_df['wind_clean'].str.contains('亂流').sum()
-    cnt_calm = hist_df['wind_clean'].str.contains('無風').sum()
-    cnt_gust = hist_df['wind_clean'].str.contains('陣風').sum()
-
-    zones = []
-    cycle_stats = {'active': {'return': []}, 'passive': {'return': []}, 'transition': {'return': []}}
-    
-    curr_start = hist_df.iloc[0]['日期']; curr_price = hist_df.iloc[0]['收']; curr_cycle = hist_df.iloc[0]['cycle']
-    for i in range(1, len(hist_df)):
-        row = hist_df.iloc[i]
-        if row['cycle'] != curr_cycle:
-            end_date = row['日期']; end_price = hist_df.iloc[i-1]['收']
-            ret = ((end_price - curr_price) / curr_price * 100) if curr_price > 0 else 0
-            zones.append({'start': curr_start, 'end': end_date, 'type': curr_cycle})
-            if curr_cycle in cycle_stats: cycle_stats[curr_cycle]['return'].append(ret)
-            curr_start = row['日期']; curr_price = row['收']; curr_cycle = row['cycle']
-    
-    last_end = hist_df.iloc[-1]['日期'] + pd.Timedelta(days=1); last_price = hist_df.iloc[-1]['收']
-    last_ret = ((last_price - curr_price) / curr_price * 100) if curr_price > 0 else 0
-    zones.append({'start': curr_start, 'end': last_end, 'type': curr_cycle})
-    if curr_cycle in cycle_stats: cycle_stats[curr_cycle]['return'].append(last_ret)
-
-    def avg_leveraged(l): base_avg = sum(l)/len(l) if l else 0; return base_avg * leverage
-    r_act = avg_leveraged(cycle_stats['active']['return'])
-    r_pass = avg_leveraged(cycle_stats['passive']['return'])
-    r_tran = avg_leveraged(cycle_stats['transition']['return'])
+    cnt_strong, cnt_chaos = analysis['wind_counts']['強風'], analysis['wind_counts']['亂流']
+    cnt_calm, cnt_gust = analysis['wind_counts']['無風'], analysis['wind_counts']['陣風']
+
+    r_act = analysis['avg_return']['active'] * leverage
+    r_pass = analysis['avg_return']['passive'] * leverage
+    r_tran = analysis['avg_return']['transition'] * leverage
     
     c_act_val = '#e74c3c' if r_act > 0 else '#27ae60'; c_pass_val = '#e74c3c' if r_pass > 0 else '#27ae60'; c_tran_val = '#e74c3c' if r_tran > 0 else ('#27ae60' if r_tran < 0 else '#95a5a6')
     
@@ -1882,36 +1961,36 @@ def render_cycle_analysis_ui(hist_df, index_name="上櫃指數"):
     st.caption(f"🌈 線上的顏色代表當日的風度：🔴強風 🟣亂流 🟡陣風 🟢無風 ____實線為 {index_name} ----虛線為 20MA (月線)。")
     
     wind_colors_map = {'強風': '#e74c3c', '亂流': '#9b59b6', '陣風': '#f1c40f', '無風': '#2ecc71'}
-    point_colors = [wind_colors_map.get(str(w).strip(), '#999') for w in hist_df['wind_clean']]
+    # 每個點的顏色 / 提示文字用整欄運算一次算好，交給 plotly 的 customdata + hovertemplate 在瀏覽器端組字串
+    point_colors = hist_df['wind_clean'].map(wind_colors_map).fillna('#999').to_numpy()
+    cycle_zh = hist_df['cycle'].map({"active":"積極", "passive":"保守", "transition":"無方向"}).fillna("-")
+    point_info = pd.DataFrame({'wind': hist_df['wind_clean'], 'cycle': cycle_zh}).to_numpy()
     
     fig = go.Figure()
     color_map_cycle = {'active': 'rgba(231, 76, 60, 0.15)', 'passive': 'rgba(46, 204, 113, 0.15)', 'transition': 'rgba(150, 150, 150, 0.2)'}
     
-    for z in zones: 
+    for z in zones.itertuples(index=False): 
         fig.add_shape(
             type="rect", 
             xref="x", yref="paper", 
-            x0=z['start'], x1=z['end'], 
+            x0=z.start, x1=z.end, 
             y0=0, y1=1, 
-            fillcolor=color_map_cycle.get(z['type'], '#eee'), 
+            fillcolor=color_map_cycle.get(z.type, '#eee'), 
             opacity=1, layer="below", line_width=0
         )
     
-    if '收' in hist_df.columns: 
-        fig.add_trace(go.Scatter(x=hist_df['日期'], y=hist_df['收'], mode='lines', name=index_name, line=dict(color='#34495e', width=1.5, shape='spline', smoothing=1.3)))
+    # 收盤線與風度點合成一條 trace (同一組 x/y 只送一次)，提示資訊放在同一條 trace 的 customdata
+    fig.add_trace(go.Scatter(
+        x=hist_df['日期'], y=hist_df['收'], mode='lines+markers', name=index_name,
+        line=dict(color='#34495e', width=1.5, shape='spline', smoothing=1.3),
+        marker=dict(color=point_colors, size=8.5, line=dict(width=1, color='white'), symbol='circle'),
+        customdata=point_info,
+        hovertemplate="<b>%{x|%Y-%m-%d}</b><br>收: %{y:,.0f}<br>向: %{customdata[0]}<br>態: %{customdata[1]}<extra></extra>"
+    ))
     
     if 'MA20' in hist_df.columns: 
         fig.add_trace(go.Scatter(x=hist_df['日期'], y=hist_df['MA20'], mode='lines', name='20MA', line=dict(color='#9b59b6', width=2, dash='dash', shape='spline', smoothing=1.3)))
     
-    fig.add_trace(go.Scatter(x=hist_df['日期'], y=hist_df['收'], mode='markers', name='每日風度', marker=dict(color=point_colors, size=8.5, line=dict(width=1, color='white'), symbol='circle'), hoverinfo='skip'))
-
-    hover_text = []
-    for idx, row in hist_df.iterrows():
-        raw_dir = row['wind_clean']
-        cycle_zh = {"active":"積極", "passive":"保守", "transition":"無方向"}.get(row['cycle'], "-")
-        hover_text.append(f"<b>{row['日期'].strftime('%Y-%m-%d')}</b><br>收: {row['收']:,.0f}<br>向: {raw_dir}<br>態: {cycle_zh}")
-    fig.add_trace(go.Scatter(x=hist_df['日期'], y=hist_df['收'], mode='markers', name='資訊', marker=dict(size=0, opacity=0), hoverinfo='text', hovertext=hover_text))
-    
     common_axis_config = dict(
         showline=True, linewidth=2, linecolor='#333333', gridcolor='#d4d4d4',
         tickfont=dict(size=14, weight='bold', color='#000000'), 
@@ -1947,35 +2026,29 @@ def render_cycle_analysis_ui(hist_df, index_name="上櫃指數"):
 
 # --- 5. 頁面視圖：戰情儀表板 (前台) [含重新整理按鈕版] ---
 def show_dashboard():
-    df = load_db()
-    if df.empty:
+    day_views = load_day_views()
+    if not day_views:
         st.info("👋 目前無資料。請至後台新增。")
         return
 
     st.sidebar.divider(); st.sidebar.header("📅 歷史回顧")
     
-    # --- 日期選擇器 ---
-    df['dt_temp'] = pd.to_datetime(df['date'], errors='coerce')
-    if not df.empty:
-        min_d = df['dt_temp'].min().date()
-        max_d = df['dt_temp'].max().date()
-        default_d = max_d
-    else:
-        min_d = datetime.now().date()
-        max_d = datetime.now().date()
-        default_d = datetime.now().date()
+    # --- 日期選擇器 (day_views 已依日期由舊到新排序) ---
+    view_dates = list(day_views)
+    min_d = datetime.strptime(view_dates[0], "%Y-%m-%d").date()
+    max_d = datetime.strptime(view_dates[-1], "%Y-%m-%d").date()
+    default_d = max_d
 
     picked_dt = st.sidebar.date_input("選擇日期", value=default_d, min_value=min_d, max_value=max_d)
     selected_date = picked_dt.strftime("%Y-%m-%d")
     
-    # --- 資料過濾 ---
-    df['compare_date'] = pd.to_datetime(df['date'], errors='coerce').dt.strftime('%Y-%m-%d')
-    day_df = df[df['compare_date'] == selected_date]
+    # --- 資料過濾 (直接查 dict) ---
+    day_data = day_views.get(selected_date)
 
-    if day_df.empty: 
+    if day_data is None: 
         st.error(f"❌ {selected_date} 無資料 (可能是假日或尚未歸檔)，請選擇其他日期。")
         return
-    day_data = day_df.iloc[0]
+    day_codes = day_data['codes']
 
     # --- 預先抓取成交值 ---
     turnover_map = {}
@@ -1987,8 +2060,7 @@ def show_dashboard():
             day_data.get('boss_bargain_list', ''),
             day_data.get('top_revenue_list', '')
         ]
-        manual_json = day_data.get('manual_turnover', None)
-        if pd.isna(manual_json): manual_json = None
+        manual_json = day_data.get('manual_turnover') or None
         turnover_map = prefetch_turnover_data(all_strategy_stocks, selected_date, manual_override_json=manual_json)
     
     # --- [新增] 頂部工具列 (重新整理按鈕) ---
@@ -1996,12 +2068,12 @@ def show_dashboard():
     col_space, col_btn = st.columns([8, 1.2]) 
     
     with col_btn:
-        # 定義 callback: 清除快取並重新執行
+        # 定義 callback: 叫背景更新馬上做下一輪 (不等結果，新報價好了之後下次重新整理就會看到)
         def force_refresh():
-            get_global_market_data_with_chart.clear() # 清除市場數據快取
+            get_market_refresher().refresh_now()
             
-        # 按鈕：點擊後會觸發 force_refresh 清除快取，Streamlit 會自動 rerun
-        st.button("🔄 手動即時更新", on_click=force_refresh, help="強制清除快取並抓取最新報價", type="primary", use_container_width=True)
+        # 按鈕：點擊後會觸發 force_refresh，Streamlit 會自動 rerun
+        st.button("🔄 手動即時更新", on_click=force_refresh, help="立即在背景抓取最新報價", type="primary", use_container_width=True)
 
     # --- 標題區塊 ---
     st.markdown(f"""<div class="title-box"><h1 style='margin:0; font-size: 2.8rem;'>📅 {selected_date} 風箏市場戰情室</h1><p style='margin-top:10px; opacity:0.9;'>資料更新於: {day_data['last_updated']}</p></div>""", unsafe_allow_html=True)
@@ -2030,69 +2102,11 @@ def show_dashboard():
     st.markdown("### 🌬️ 每日風度與風箏數")
 
     wind_status = day_data['wind']
-    wind_streak = calculate_wind_streak(df, selected_date)
-    
-# 【修改】使用強壯版函式獲取櫃買數據
-    # 無論是 Local 還是 Cloud，這行都能確保盡力拿到數字
-    tpex_info = get_tpex_robust()
+    wind_streak = day_data['wind_streak']
     
-    # 1. 優先嘗試官方 API (Local端最準，但雲端可能被擋)
-    try:
-        official_data = fetch_official_tw_index_data()
-        if "^TWOII" in official_data:
-            tpex_info = official_data["^TWOII"]
-    except Exception:
-        pass
-
-    # 2. 如果官方 API 失敗 (價格仍為 0)，啟動 yfinance 救援 (雲端適用)
-    if tpex_info['price'] == 0:
-        try:
-            # 使用 yfinance 的 fast_info 獲取即時數據
-            yf_ticker = yf.Ticker("^TWOII")
-            fi = yf_ticker.fast_info
-            
-            # 獲取價格
-            last_price = fi.last_price
-            prev_close = fi.previous_close
-            
-            if last_price and prev_close and last_price > 0:
-                change = last_price - prev_close
-                pct_change = (change / prev_close) * 100
-                
-                tpex_info = {
-                    'price': last_price,
-                    'change': change,
-                    'pct_change': pct_change
-                }
-        except Exception as e:
-            print(f"TPEx Fallback Error: {e}")
-
-# =========== 【請在這邊插入新增的程式碼】 ===========
-    # 目的：抓取加權指數 (TAIEX) 資料
-    try:
-        # ^TWII 是加權指數的代號
-        twii = yf.Ticker("^TWII") 
-        hist = twii.history(period="5d")
-        
-        if not hist.empty:
-            price_now = hist['Close'].iloc[-1]
-            price_prev = hist['Close'].iloc[-2]
-            change = price_now - price_prev
-            pct = (change / price_prev) * 100
-            
-            # 定義 taiex 變數 (這就是缺少的那個！)
-            taiex = {
-                'price': price_now,
-                'change': change,
-                'pct_change': pct
-            }
-        else:
-            taiex = {'price': 0, 'change': 0, 'pct_change': 0}
-            
-    except Exception as e:
-        print(f"加權指數抓取失敗: {e}")
-        taiex = {'price': 0, 'change': 0, 'pct_change': 0}
-    # ====================================================
+    # 加權 / 櫃買即時報價：直接讀背景更新的報價快照 (官方 API -> fast_info -> 日線)，不在這裡等網路
+    tpex_info = get_index_quote("^TWOII")
+    taiex = get_index_quote("^TWII")
 
     # --- 1. 獲取資料 (這裡假設你已經讀取了歷史檔 df_history) ---
     # 假設最後一筆是最新資料
@@ -2122,20 +2136,11 @@ def show_dashboard():
     taiex_w_bias = 0.0
     
     if not df_taiex.empty:
-        # 【修正點 1】: 補上 'date' 欄位
-        if '日期' in df_taiex.columns:
-            df_taiex['date'] = df_taiex['日期'].dt.strftime('%Y-%m-%d')
-        
-        # 【修正點 2】: 補上 'wind' 欄位 (這是這次報錯的原因)
-        if '風度' in df_taiex.columns:
-            df_taiex['wind'] = df_taiex['風度']
-            
-        # 取得最新一筆
+        # 取得最新一筆；連續天數直接查預先算好的風度分段 (資料沒換就不必重算)
         latest_taiex = df_taiex.iloc[-1]
         taiex_w_status = str(latest_taiex['風度']).strip()
-        
-        # 現在 df_taiex 裡面同時有 'date' 和 'wind' 了，計算函式就能正常運作
-        taiex_w_streak = calculate_wind_streak(df_taiex, latest_taiex['日期'].strftime("%Y-%m-%d"))
+        taiex_runs = load_wind_runs(HISTORY_FILE_TAIEX)
+        if taiex_runs is not None: taiex_w_streak = taiex_runs.at(latest_taiex['日期'])[1]
         
         try:
             taiex_w_bias = float(str(latest_taiex['乖離率']).replace('%', '').strip())
@@ -2148,19 +2153,11 @@ def show_dashboard():
     tpex_w_bias = 0.0
     
     if not df_tpex.empty:
-        # 【修正點 1】: 補上 'date' 欄位
-        if '日期' in df_tpex.columns:
-            df_tpex['date'] = df_tpex['日期'].dt.strftime('%Y-%m-%d')
-
-        # 【修正點 2】: 補上 'wind' 欄位
-        if '風度' in df_tpex.columns:
-            df_tpex['wind'] = df_tpex['風度']
-
         # 取得最新一筆
         latest_tpex = df_tpex.iloc[-1]
         tpex_w_status = str(latest_tpex['風度']).strip()
-        
-        tpex_w_streak = calculate_wind_streak(df_tpex, latest_tpex['日期'].strftime("%Y-%m-%d"))
+        tpex_runs = load_wind_runs(HISTORY_FILE_TPEX)
+        if tpex_runs is not None: tpex_w_streak = tpex_runs.at(latest_tpex['日期'])[1]
         
         try:
             tpex_w_bias = float(str(latest_tpex['乖離率']).replace('%', '').strip())
@@ -2254,21 +2251,20 @@ def show_dashboard():
 
     st.markdown('<div class="strategy-banner worker-banner"><p class="banner-text">👨‍💼 上班族策略 (Worker Strategy)</p></div>', unsafe_allow_html=True)
     w1, w2 = st.columns(2)
-    with w1: st.markdown("### 🚀 強勢週 TOP 3"); st.markdown(render_stock_tags_v113(day_data['worker_strong_list'], turnover_map), unsafe_allow_html=True)
-    with w2: st.markdown("### 📈 週趨勢"); st.markdown(render_stock_tags_v113(day_data['worker_trend_list'], turnover_map), unsafe_allow_html=True)
+    with w1: st.markdown("### 🚀 強勢週 TOP 3"); st.markdown(render_stock_tags_v113(day_data['worker_strong_list'], turnover_map, day_codes), unsafe_allow_html=True)
+    with w2: st.markdown("### 📈 週趨勢"); st.markdown(render_stock_tags_v113(day_data['worker_trend_list'], turnover_map, day_codes), unsafe_allow_html=True)
 
     st.markdown('<div class="strategy-banner boss-banner"><p class="banner-text">👑 老闆策略 (Boss Strategy)</p></div>', unsafe_allow_html=True)
     b1, b2 = st.columns(2)
-    with b1: st.markdown("### ↩️ 週拉回"); st.markdown(render_stock_tags_v113(day_data['boss_pullback_list'], turnover_map), unsafe_allow_html=True)
-    with b2: st.markdown("### 🏷️ 廉價收購"); st.markdown(render_stock_tags_v113(day_data['boss_bargain_list'], turnover_map), unsafe_allow_html=True)
+    with b1: st.markdown("### ↩️ 週拉回"); st.markdown(render_stock_tags_v113(day_data['boss_pullback_list'], turnover_map, day_codes), unsafe_allow_html=True)
+    with b2: st.markdown("### 🏷️ 廉價收購"); st.markdown(render_stock_tags_v113(day_data['boss_bargain_list'], turnover_map, day_codes), unsafe_allow_html=True)
 
     st.markdown('<div class="strategy-banner revenue-banner"><p class="banner-text">💰 營收創高 (TOP 6)</p></div>', unsafe_allow_html=True)
-    st.markdown(render_stock_tags_v113(day_data['top_revenue_list'], turnover_map), unsafe_allow_html=True)
+    st.markdown(render_stock_tags_v113(day_data['top_revenue_list'], turnover_map, day_codes), unsafe_allow_html=True)
 
     st.markdown("---")
     st.header("📊 市場數據趨勢分析")
-    chart_df = df.copy(); chart_df['date_dt'] = pd.to_datetime(chart_df['date']); chart_df = chart_df.sort_values('date_dt', ascending=True)
-    chart_df['Month'] = chart_df['date_dt'].dt.strftime('%Y-%m')
+    chart_df = load_frame() # 標準表已依日期由舊到新排序，Month 也已算好
 
     tab1, tab2, tab3, tab4 = st.tabs(["📈 每日風箏數量", "🌬️ 每日風度分佈", "🔄 2025 年風度循環回顧",  "📅 每月風度統計"])
     
@@ -2317,7 +2313,7 @@ def show_dashboard():
         st.altair_chart(wind_chart, use_container_width=True)
         
     with tab4:
-        monthly_wind = chart_df.groupby(['Month', 'wind']).size().reset_index(name='count')
+        monthly_wind = chart_df.groupby(['Month', 'wind'], observed=True).size().reset_index(name='count')
         color_map = {'無風': '#2ecc71', '陣風': '#f1c40f', '亂流': '#9b59b6', '強風': '#e74c3c'}
         wind_types = ['無風', '陣風', '亂流', '強風']
         fig = go.Figure()
@@ -2346,35 +2342,56 @@ def show_dashboard():
         
         if "上櫃" in cycle_market:
             # 載入櫃買資料
-            hist_df = load_history_data(HISTORY_FILE_TPEX)
-            render_cycle_analysis_ui(hist_df, index_name="上櫃指數")
+            render_cycle_analysis_ui(HISTORY_FILE_TPEX, index_name="上櫃指數")
         else:
             # 載入加權資料
-            hist_df = load_history_data(HISTORY_FILE_TAIEX)
-            render_cycle_analysis_ui(hist_df, index_name="加權指數")
+            render_cycle_analysis_ui(HISTORY_FILE_TAIEX, index_name="加權指數")
 
     st.markdown("---")
 
     st.header("🏆 策略選股月度風雲榜")
     st.caption("統計各策略下，股票出現的次數與所屬族群。")
     
-    stats_df = calculate_monthly_stats(df)
+    # 由 SQLite appearance 表直接查詢該月份 (有索引，不必整份 explode)
+    db_index = get_db_index()
+    month_list = db_index.months()
     
-    if not stats_df.empty:
-        month_list = stats_df['Month'].unique()
-        selected_month = st.selectbox("選擇統計月份", options=month_list)
-        
-        # 篩選月份
-        filtered_stats = stats_df[stats_df['Month'] == selected_month]
+    if month_list:
+        range_mode = st.radio("統計區間", ["月份", "最近 5 日", "最近 10 日", "最近 20 日", "自訂區間"], horizontal=True, key="leaderboard_range")
+        turnover_label = "日均成交(億)"
         
-        # --- [新增] 計算該月份所有出現股票的平均成交值 ---
-        with st.spinner("正在計算月均成交值..."):
-            all_unique_stocks = filtered_stats['stock'].unique().tolist()
-            # 呼叫上面新增的計算函式
-            monthly_turnover_map = get_monthly_avg_turnover(all_unique_stocks, selected_month)
+        if range_mode == "月份":
+            selected_month = st.selectbox("選擇統計月份", options=month_list)
             
-            # 將成交值 map 回 dataframe
-            filtered_stats['AvgTurnover'] = filtered_stats['stock'].map(monthly_turnover_map).fillna(0)
+            # 只讀選定月份 (leaderboard 表在存檔時已依月份增量更新，族群也已算好)
+            filtered_stats = db_index.monthly_leaderboard(selected_month)
+            
+            # --- [新增] 計算該月份所有出現股票的平均成交值 ---
+            with st.spinner("正在計算月均成交值..."):
+                all_unique_stocks = filtered_stats['stock'].unique().tolist()
+                # 呼叫上面新增的計算函式
+                monthly_turnover_map = get_monthly_avg_turnover(all_unique_stocks, selected_month)
+                
+                # 將成交值 map 回 dataframe
+                filtered_stats['AvgTurnover'] = filtered_stats['stock'].map(monthly_turnover_map).fillna(0)
+            turnover_label = "月均成交(億)"
+        else:
+            # 任意區間：出現矩陣的前綴和相減 (與區間長短無關)，成交值也用同一份每日成交值前綴和
+            presence = load_presence()
+            if range_mode == "自訂區間":
+                c_start, c_end = st.columns(2)
+                with c_start: range_start = st.date_input("起始日", value=presence.dates[max(len(presence.dates) - 20, 0)].date(), key="leaderboard_start")
+                with c_end: range_end = st.date_input("結束日", value=presence.dates[-1].date(), key="leaderboard_end")
+                filtered_stats = presence.range_leaderboard(start=range_start, end=range_end)
+            else:
+                last_n = int(range_mode.split()[1])
+                filtered_stats = presence.range_leaderboard(last_n=last_n)
+                range_start, range_end = presence.window_dates(last_n)
+                st.caption(f"{range_start.strftime('%Y-%m-%d')} ~ {range_end.strftime('%Y-%m-%d')}")
+            filtered_stats['Industry'] = SYMBOLS.resolve_many(filtered_stats['stock'])[2]
+            with st.spinner("正在計算區間均成交值..."):
+                range_turnover_map = get_range_avg_turnover(filtered_stats['stock'].unique().tolist(), range_start, range_end)
+                filtered_stats['AvgTurnover'] = filtered_stats['stock'].map(range_turnover_map).fillna(0)
 
         strategies_list = filtered_stats['Strategy'].unique()
         cols1 = st.columns(3)
@@ -2396,12 +2413,12 @@ def show_dashboard():
                     format="%d次", 
                     min_value=0, 
                     max_value=max_count,
-                    help="該股票在這個月符合策略的次數",
+                    help="該股票在統計區間內符合策略的次數",
                 ),
                 "AvgTurnover": st.column_config.NumberColumn(  # 改用 NumberColumn
-                    "月均成交(億)", 
+                    turnover_label, 
                     format="$%.1f億", 
-                    help="該月份的平均每日成交金額"
+                    help="統計區間內的平均每日成交金額"
                 ),
                 "Industry": st.column_config.TextColumn("族群", help="所屬產業類別")
             }
@@ -2425,6 +2442,48 @@ def show_dashboard():
                     use_container_width=True, 
                     column_config=col_config
                 )
+        
+        with st.expander("🔎 個股出現紀錄查詢", expanded=False):
+            query_stock = st.text_input("輸入股票名稱或代號", key="stock_history_query")
+            if query_stock:
+                history_df = db_index.stock_history(query_stock)
+                if history_df.empty: st.info(f"查無 {query_stock} 的策略出現紀錄")
+                else:
+                    st.caption(f"共出現 {len(history_df)} 次，最近一次：{history_df['date'].iloc[0]}")
+                    st.dataframe(history_df, hide_index=True, use_container_width=True, column_config={"date": "日期", "strategy": "策略", "stock": "股票名稱", "is_cb": st.column_config.CheckboxColumn("CB")})
+
+        # --- 連續上榜 / 多策略共振 (出現矩陣的向量運算，不必重新拆字串) ---
+        with st.expander("🧬 連續上榜與多策略共振", expanded=False):
+            presence = load_presence()
+            col_p1, col_p2 = st.columns(2)
+            with col_p1:
+                st.markdown("#### 📆 連續上榜天數")
+                streak_strats = st.multiselect(
+                    "策略 (任一入選即算)", options=presence.strategies, default=presence.strategies[:1],
+                    format_func=lambda c: STRATEGY_LABELS.get(c, c), key="presence_streak_strats"
+                )
+                streak_df = presence.streaks(streak_strats).head(20).reset_index()
+                if streak_df.empty: st.info("目前沒有連續上榜的股票")
+                else:
+                    st.caption(f"截至 {presence.dates[-1].strftime('%Y-%m-%d')}")
+                    st.dataframe(streak_df, hide_index=True, use_container_width=True, column_config={
+                        "stock": "股票名稱",
+                        "streak": st.column_config.ProgressColumn("連續天數", format="%d天", min_value=0, max_value=int(streak_df['streak'].max())),
+                    })
+            with col_p2:
+                st.markdown("#### 🎯 多策略共振")
+                c_days, c_min = st.columns(2)
+                with c_days: overlap_days = st.number_input("最近幾個交易日", min_value=1, max_value=60, value=5, key="presence_days")
+                with c_min: min_strats = st.number_input("至少幾個策略", min_value=1, max_value=len(STRATEGY_LABELS), value=3, key="presence_min")
+                overlap_df = presence.overlap(int(overlap_days), min_strategies=int(min_strats)).reset_index()
+                first_day, last_day = presence.window_dates(int(overlap_days))
+                if overlap_df.empty: st.info(f"最近 {overlap_days} 個交易日沒有同時出現在 {min_strats} 個以上策略的股票")
+                else:
+                    st.caption(f"{first_day.strftime('%Y-%m-%d')} ~ {last_day.strftime('%Y-%m-%d')}")
+                    st.dataframe(overlap_df, hide_index=True, use_container_width=True, column_config={
+                        "stock": "股票名稱", "strategies": "策略數", "appearances": "出現次數",
+                        **{label: st.column_config.CheckboxColumn(label) for label in STRATEGY_LABELS.values()},
+                    })
     else: 
         st.info("累積足夠資料後，將在此顯示統計排行。")
 
@@ -2466,6 +2525,42 @@ def show_dashboard():
             st.markdown('<a href="https://service-82255878134.us-west1.run.app/"  target="_blank" class="link-btn">Ding-風箏策略儀表板</a>', unsafe_allow_html=True)
 
 # --- 6. 頁面視圖：管理後台 (後台) ---
+def import_history_upload(uploaded_file, target_path, label):
+    # 串流匯入：檔頭判斷編碼、分塊解析並檢查欄位，邊讀邊更新進度條
+    bar = st.progress(0.0, text=f"匯入{label}中...")
+    try:
+        report = import_history_csv(
+            uploaded_file, target_path,
+            progress=lambda rows, frac: bar.progress(frac, text=f"匯入{label}中... {rows:,} 筆")
+        )
+        _load_history_shared.clear()
+        _load_wind_runs_shared.clear()
+        _load_cycle_shared.clear()
+        bar.empty()
+        st.success(f"✅ {label}已更新！(編碼: {report['encoding']}, {report['rows']:,} 筆資料, {report['rows_per_sec']:,.0f} 筆/秒)")
+        if report['lenient_dates']: st.info(f"ℹ️ 有 {report['lenient_dates']} 筆日期不是 YYYY.MM.DD 格式，已自動判斷格式解析 (請確認日期正確)")
+        if report['bad_dates']: st.warning(f"⚠️ 有 {report['bad_dates']} 筆日期無法解析，已略過")
+    except ValueError as e:
+        bar.empty()
+        st.error(f"❌ 檔案讀取失敗：{e}")
+    except Exception as e:
+        bar.empty()
+        st.error(f"❌ 嚴重錯誤: {e}")
+
+def apply_name_fixes(df, fixes):
+    """把各策略欄位裡的名稱依 fixes {原名稱: 新名稱} 替換 (替換後去重，順序不變)"""
+    if not fixes: return df
+    df = df.copy()
+    def fix_list(stock_str):
+        res = []
+        for stock in str(stock_str).split("、"):
+            stock = fixes.get(stock.strip(), stock.strip())
+            if stock and stock not in res: res.append(stock)
+        return "、".join(res)
+    for col in LIST_COLS:
+        if col in df.columns: df[col] = df[col].fillna("").map(fix_list)
+    return df
+
 def show_admin_panel():
     st.title("⚙️ 資料管理後台")
     if not GOOGLE_API_KEY: st.error("❌ 未設定 API Key"); return
@@ -2477,46 +2572,51 @@ def show_admin_panel():
     history_file = st.file_uploader("上傳 kite_history.csv", type=["csv"], key="history_uploader")
     
     if history_file is not None:
-        # (保留原本的讀取與儲存邏輯)
-        try:
-            history_file.seek(0)
-            file_bytes = history_file.read()
-            success = False
-            for enc in ['utf-8-sig', 'utf-8', 'big5', 'cp950']:
-                try:
-                    temp_df = pd.read_csv(io.BytesIO(file_bytes), encoding=enc)
-                    temp_df.columns = temp_df.columns.str.strip()
-                    if '日期' in temp_df.columns and '風度' in temp_df.columns:
-                        temp_df.to_csv(HISTORY_FILE, index=False, encoding='utf-8-sig')
-                        st.success(f"✅ 歷史檔案已更新！(編碼: {enc}, {len(temp_df)} 筆資料)")
-                        success = True
-                        break
-                except: continue
-            if not success: st.error("❌ 檔案讀取失敗")
-        except Exception as e: st.error(f"❌ 嚴重錯誤: {e}")
+        import_history_upload(history_file, HISTORY_FILE, "歷史檔案")
 
 # --- 【新增】上傳加權指數歷史檔 ---
     st.subheader("📥 上傳 [加權指數] 風度歷史檔")
     taiex_file = st.file_uploader("上傳 kite_history_taiex.csv", type=["csv"], key="taiex_uploader")
     
     if taiex_file is not None:
-        try:
-            taiex_file.seek(0)
-            file_bytes = taiex_file.read()
-            success = False
-            for enc in ['utf-8-sig', 'utf-8', 'big5', 'cp950']:
-                try:
-                    temp_df = pd.read_csv(io.BytesIO(file_bytes), encoding=enc)
-                    temp_df.columns = temp_df.columns.str.strip()
-                    if '日期' in temp_df.columns and '風度' in temp_df.columns:
-                        temp_df.to_csv(HISTORY_FILE_TAIEX, index=False, encoding='utf-8-sig')
-                        st.success(f"✅ 加權指數歷史檔已更新！(編碼: {enc}, {len(temp_df)} 筆資料)")
-                        success = True
-                        break
-                except: continue
-            if not success: st.error("❌ 檔案讀取失敗，請確認格式 (需包含 '日期' 與 '風度' 欄位)")
-        except Exception as e: st.error(f"❌ 嚴重錯誤: {e}")
+        import_history_upload(taiex_file, HISTORY_FILE_TAIEX, "加權指數歷史檔")
 
+    # --- 全市場股票主檔 (決定每檔股票抓 .TW 還是 .TWO) ---
+    st.subheader("🗂️ 全市場股票主檔")
+    if os.path.exists(STOCK_MASTER_FILE):
+        st.caption(f"目前主檔：{len(SYMBOLS.markets):,} 檔，更新於 {datetime.fromtimestamp(os.path.getmtime(STOCK_MASTER_FILE)).strftime('%Y-%m-%d %H:%M')}")
+    else:
+        st.caption("尚未建立主檔：目前只有手動維護的股票知道代號，抓報價時上市/上櫃兩個後綴都要試。")
+    if st.button("🔄 從證交所更新主檔 (上市 + 上櫃)"):
+        with st.spinner("下載證交所 ISIN 清單中..."):
+            try:
+                master_df = fetch_isin_master()
+                save_master_file(master_df, STOCK_MASTER_FILE)
+                _build_symbol_resolver.clear()
+                st.success(f"✅ 主檔已更新：{len(master_df):,} 檔")
+            except Exception as e:
+                st.error(f"❌ 主檔更新失敗: {e}")
+
+    # --- 外部資料來源狀態 (熔斷器 + 背景報價快照) ---
+    st.subheader("🩺 外部資料來源狀態")
+    def fmt_ts(ts): return datetime.fromtimestamp(ts, tz=pytz.timezone('Asia/Taipei')).strftime('%m/%d %H:%M:%S') if ts else "-"
+    state_labels = {'closed': '🟢 正常', 'open': '🔴 熔斷中', 'half-open': '🟡 試探中'}
+    circuit_rows = circuit_states()
+    st.dataframe(pd.DataFrame([{
+        "來源": row['source'], "狀態": state_labels.get(row['state'], row['state']), "連續失敗": row['failures'],
+        "暫停剩餘(秒)": row['blocked_for'], "已呼叫": row['calls'], "已跳過": row['skipped'],
+        "最後成功": fmt_ts(row['last_success_at']), "最後失敗": fmt_ts(row['last_failure_at']), "最後錯誤": row['last_error'] or "",
+    } for row in circuit_rows]), use_container_width=True, hide_index=True)
+    snapshot = get_market_snapshot()
+    if snapshot:
+        late = {k: v for k, v in snapshot.status.items() if v != 'ok'}
+        st.caption(f"報價快照：{fmt_ts(snapshot.fetched_at)}；" + ("全部即時" if not late else "未即時更新：" + "、".join(f"{k} ({v})" for k, v in late.items())))
+    else:
+        st.caption("報價快照：背景第一輪尚未完成")
+    if st.button("♻️ 重設所有熔斷器 (立即重試)"):
+        for row in circuit_rows: circuit(row['source']).reset()
+        get_market_refresher().refresh_now()
+        st.rerun()
 
     # --- V164 新增：後台專屬的詳細循環清單 (Debug) ---
     if os.path.exists(HISTORY_FILE):
@@ -2584,6 +2684,7 @@ def show_admin_panel():
                         st.write("解析出的資料筆數:", len(raw_data))
                     if not isinstance(raw_data, list): raw_data = []
                     processed_list = []
+                    name_fixes = {} # OCR 名稱 -> (建議名稱, 信心分數)；存檔前由管理員勾選要不要採用
                     for item in raw_data:
                         if not isinstance(item, dict): continue
                         def get_col_stocks(start, end):
@@ -2592,6 +2693,9 @@ def show_admin_panel():
                                 val = item.get(f"col_{i:02d}")
                                 if val and str(val).lower() != 'null':
                                     val_str = str(val).strip()
+                                    # 模糊比對找建議名稱 (多了空白、*、全形字、名稱被截斷...)，先不替換
+                                    suggestion, score = SYMBOLS.suggest_name(val_str)
+                                    if suggestion is not None: name_fixes[val_str] = (suggestion, score)
                                     if val_str not in seen: res.append(val_str); seen.add(val_str)
                             return "、".join(res)
                         if not item.get("col_01"): continue
@@ -2611,12 +2715,26 @@ def show_admin_panel():
                         }
                         processed_list.append(record)
                     st.session_state.preview_df = pd.DataFrame(processed_list)
+                    st.session_state.preview_fixes = name_fixes
             except Exception as e: st.error(f"錯誤: {e}")
 
     if st.session_state.preview_df is not None:
         st.info("👇 請確認下方資料，可直接點擊修改，無誤後按「存入資料庫」。")
+        name_fixes = st.session_state.get('preview_fixes') or {}
+        edited_fixes = None
+        if name_fixes:
+            # 只有正規化後完全相同 (信心 100%) 的預設勾選，其餘由管理員確認後再勾
+            st.caption("🔧 以下名稱不在股票主檔，勾選要採用的建議名稱 (存檔時替換)：")
+            edited_fixes = st.data_editor(
+                pd.DataFrame([{"辨識名稱": raw, "建議名稱": fixed, "信心": f"{score:.0%}", "採用": score >= 1.0}
+                              for raw, (fixed, score) in name_fixes.items()]),
+                disabled=["辨識名稱", "建議名稱", "信心"], hide_index=True, use_container_width=True, key="name_fix_editor"
+            )
         edited_new = st.data_editor(st.session_state.preview_df, num_rows="dynamic", use_container_width=True)
         if st.button("✅ 存入資料庫"):
+            if edited_fixes is not None:
+                accepted = dict(edited_fixes.loc[edited_fixes["採用"], ["辨識名稱", "建議名稱"]].itertuples(index=False))
+                edited_new = apply_name_fixes(edited_new, accepted)
             save_batch_data(edited_new)
             st.success("已存檔！")
             st.session_state.preview_df = None
@@ -2659,6 +2777,11 @@ def show_admin_panel():
                 time.sleep(1)
                 st.rerun()
                 
+            pending = get_db_store().log_size()
+            if pending and st.button(f"🧹 整併更新紀錄 ({pending} 筆待整併)"):
+                merged_months = compact_db()
+                st.success(f"已整併 {len(merged_months)} 個月份：{', '.join(merged_months)}")
+                
             if st.button("🗑️ 清空資料庫 (慎用)"): 
                 clear_db()
                 st.warning("已清空")
@@ -2669,6 +2792,27 @@ def show_admin_panel():
             
     else: st.info("目前無資料")
 
+    # 還原點放在編輯器外面：清空資料庫後也能救回
+    journal = BackupJournal(DB_BACKUP_DIR)
+    points = journal.restore_points()
+    if not points.empty:
+        with st.expander(f"⏪ 備份還原點 ({len(points)} 個)", expanded=False):
+            op_labels = {'checkpoint': '基準', 'upsert': '新增/更新', 'replace': '編輯存檔', 'clear': '清空'}
+            point_labels = {
+                p.seq: f"#{p.seq}｜{p.ts}｜{op_labels.get(p.op, p.op)}｜變動 {p.changed} 天｜共 {p.total} 天"
+                for p in points.itertuples(index=False)
+            }
+            seq = st.selectbox("選擇還原點", list(point_labels), format_func=point_labels.get)
+            if st.button("⏪ 還原到此時間點"):
+                restored = journal.snapshot(seq=seq)
+                if restored.empty:
+                    clear_db()
+                else:
+                    save_full_history(restored)
+                st.success(f"已還原到 #{seq} (還原本身也會記成一個新的還原點)")
+                time.sleep(1)
+                st.rerun()
+
 # --- 7. 主導航 ---
 def main():
     st.sidebar.title("導航")
@@ -8,6 +8,8 @@ import json
 import time
 from datetime import datetime
 import altair as alt
+from kite_store import MonthPartitionedStore, default_store_dir, migrate_csv_to_store
+from kite_sqlite import KiteSqliteStore, default_sqlite_path
 
 # --- 1. 頁面與 CSS (V72: 平衡版面 + 權限控管) ---
 st.set_page_config(layout="wide", page_title="StockTrack V72 權限控管版", page_icon="🔒")
@@ -104,36 +106,59 @@ genai.configure(api_key=GOOGLE_API_KEY)
 generation_config = {"temperature": 0.0, "response_mime_type": "application/json"}
 model = genai.GenerativeModel(model_name="gemini-2.0-flash", generation_config=generation_config)
 DB_FILE = 'stock_data_v72.csv'
+DB_STORE_DIR = default_store_dir(DB_FILE) # 分月 Parquet 資料庫 (stock_data_v72_store/)
+DB_SQLITE_FILE = default_sqlite_path(DB_FILE) # 選股出現紀錄索引 (stock_data_v72.sqlite)
 
 # --- 3. 核心函數 ---
-def load_db():
-    if os.path.exists(DB_FILE):
-        try:
-            df = pd.read_csv(DB_FILE, encoding='utf-8-sig')
-            if 'date' in df.columns:
-                df['date'] = df['date'].astype(str)
-                return df.sort_values('date', ascending=False)
+def get_db_store():
+    store = MonthPartitionedStore(DB_STORE_DIR)
+    # 舊版 CSV 第一次讀取時轉成分月 Parquet
+    if not store.exists() and os.path.exists(DB_FILE):
+        try: migrate_csv_to_store(DB_FILE, DB_STORE_DIR)
+        except Exception as e: print(f"DB Migrate Error: {e}")
+    return store
+
+def get_db_index():
+    index = KiteSqliteStore(DB_SQLITE_FILE)
+    # 索引記錄的寫入次數與分月資料庫對不上 (第一次使用、索引檔遺失、上次存檔時索引寫入失敗...) 就整份重建
+    writes = get_db_store().write_count()
+    if index.synced_writes() != writes:
+        index.replace_all(load_db(), synced=writes)
+    return index
+
+def load_db(columns=None, months=None):
+    store = get_db_store()
+    if store.exists():
+        try: return store.read(columns=columns, months=months)
         except: return pd.DataFrame()
     return pd.DataFrame()
 
 def save_batch_data(records_list):
-    df = load_db()
     # 處理輸入可能是 list 或 DataFrame
     if isinstance(records_list, list):
         new_data = pd.DataFrame(records_list)
     else:
         new_data = records_list
 
-    if not df.empty:
+    if not new_data.empty:
         new_data['date'] = new_data['date'].astype(str)
-        df = df[~df['date'].isin(new_data['date'])]
-        df = pd.concat([df, new_data], ignore_index=True)
-    else: df = new_data
-    df = df.sort_values('date', ascending=False)
-    df.to_csv(DB_FILE, index=False, encoding='utf-8-sig')
-    return df
+        # 先讓索引追上資料庫；失敗只記錄，選股照樣寫進資料庫 (同步點沒前進，下次 get_db_index 會再重建)
+        try: index = get_db_index()
+        except Exception as e:
+            index = None
+            print(f"DB Index Error: {e}")
+        store = get_db_store()
+        before = store.write_count()
+        store.upsert(new_data)
+        # 索引寫入失敗時同步點不會前進，下次 get_db_index 會由資料庫重建
+        if index is not None:
+            try: index.upsert_days(new_data, synced=(before, store.write_count()))
+            except Exception as e: print(f"DB Index Error: {e}")
+    return load_db()
 
 def clear_db():
+    get_db_store().clear()
+    KiteSqliteStore(DB_SQLITE_FILE).clear()
     if os.path.exists(DB_FILE): os.remove(DB_FILE)
 
 # 維持最準確的 V50 邏輯 (數字錨點)
@@ -165,33 +190,6 @@ def ai_analyze_v50_grid(image):
     except Exception as e: return json.dumps({"error": str(e)})
 
 # --- 4. 統計與繪圖函數 ---
-def calculate_monthly_stats(df):
-    if df.empty: return pd.DataFrame()
-    df['dt'] = pd.to_datetime(df['date'], errors='coerce')
-    df['Month'] = df['dt'].dt.strftime('%Y-%m')
-    strategies = {
-        '🔥 強勢週': 'worker_strong_list', '📈 週趨勢': 'worker_trend_list',
-        '↩️ 週拉回': 'boss_pullback_list', '🏷️ 廉價收購': 'boss_bargain_list',
-        '💰 營收 TOP6': 'top_revenue_list'
-    }
-    all_stats = []
-    for strategy_name, col_name in strategies.items():
-        if col_name not in df.columns: continue
-        temp = df[['Month', col_name]].copy()
-        temp[col_name] = temp[col_name].astype(str)
-        temp = temp[temp[col_name].notna() & (temp[col_name] != 'nan') & (temp[col_name] != '')]
-        temp['stock'] = temp[col_name].str.split('、')
-        exploded = temp.explode('stock')
-        exploded['stock'] = exploded['stock'].str.strip()
-        exploded = exploded[exploded['stock'] != '']
-        counts = exploded.groupby(['Month', 'stock']).size().reset_index(name='Count')
-        counts['Strategy'] = strategy_name
-        all_stats.append(counts)
-    if not all_stats: return pd.DataFrame()
-    final_df = pd.concat(all_stats)
-    final_df = final_df.sort_values(['Month', 'Strategy', 'Count'], ascending=[False, True, False])
-    return final_df
-
 def render_metric_card(col, label, value, color_border="gray"):
     col.markdown(f"""<div class="metric-container" style="border-top: 5px solid {color_border};"><div class="metric-label">{label}</div><div class="metric-value">{value}</div></div>""", unsafe_allow_html=True)
 
@@ -292,11 +290,11 @@ def show_dashboard():
 
     st.markdown("---")
     st.header("🏆 策略選股月度風雲榜")
-    stats_df = calculate_monthly_stats(df)
-    if not stats_df.empty:
-        month_list = stats_df['Month'].unique()
+    db_index = get_db_index()
+    month_list = db_index.months()
+    if month_list:
         selected_month = st.selectbox("選擇統計月份", options=month_list)
-        filtered_stats = stats_df[stats_df['Month'] == selected_month]
+        filtered_stats = db_index.monthly_leaderboard(selected_month)
         strategies_list = filtered_stats['Strategy'].unique()
         cols1 = st.columns(3); cols2 = st.columns(3)
         for i, strategy in enumerate(strategies_list):
@@ -0,0 +1,204 @@
+# --- 風箏戰情室：增量備份日誌 (Delta backup journal) ---
+# 每次存檔只備份「有變動的那幾天」：每一筆資料以內容雜湊 (sha256) 存成壓縮檔，內容相同只存一份；
+# journal.jsonl 依序記錄每次存檔改了哪些日期 -> 哪個雜湊。把日誌重播到某一筆，就能還原當時的資料庫。
+# 過期的紀錄會被折疊成一個 checkpoint (只存 日期 -> 雜湊 對照)，沒人引用的資料檔再一併清掉。
+# 本模組不依賴 Streamlit。
+import os
+import json
+import gzip
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from kite_store import normalize_records, atomic_write_bytes
+
+JOURNAL_FILE = 'journal.jsonl'
+OBJECTS_DIR = 'objects'
+KEEP_DAYS = 30      # 保留最近 30 天的還原點
+MAX_ENTRIES = 300   # 日誌超過這個筆數就觸發清理 (仍會保留 KEEP_DAYS 內的還原點)
+
+_JOURNAL_LOCK = threading.RLock()
+
+
+def default_backup_dir(csv_path):
+    """stock_data_v74.csv -> stock_data_v74_backup/ (放在資料庫目錄外，清空資料庫時不會一起刪掉)"""
+    stem, _ = os.path.splitext(csv_path)
+    return f"{stem}_backup"
+
+
+def _row_bytes(record):
+    return json.dumps(record, ensure_ascii=False, sort_keys=True, default=int).encode('utf-8')
+
+
+class BackupJournal:
+    """
+    root/
+        journal.jsonl               <- {'seq', 'ts', 'op', 'rows': {date: hash 或 null(刪除)}}
+        objects/ab/abcdef....json.gz
+    op: 'upsert' (部分日期) / 'replace' (整份存檔，只記差異) / 'clear' / 'checkpoint' (清理後的基準點)
+    """
+
+    def __init__(self, root, keep_days=KEEP_DAYS, max_entries=MAX_ENTRIES):
+        self.root = root
+        self.keep_days = keep_days
+        self.max_entries = max_entries
+
+    # --- 路徑 ---
+    def _journal_path(self):
+        return os.path.join(self.root, JOURNAL_FILE)
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, OBJECTS_DIR, digest[:2], f"{digest}.json.gz")
+
+    # --- 資料檔 (content-addressed) ---
+    def _put_row(self, record):
+        data = _row_bytes(record)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            atomic_write_bytes(path, gzip.compress(data))
+        return digest
+
+    def _get_row(self, digest):
+        with open(self._object_path(digest), 'rb') as f:
+            return json.loads(gzip.decompress(f.read()).decode('utf-8'))
+
+    @staticmethod
+    def _digest(record):
+        return hashlib.sha256(_row_bytes(record)).hexdigest()
+
+    # --- 日誌 ---
+    def entries(self):
+        path = self._journal_path()
+        if not os.path.exists(path): return []
+        found = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith("\n"): break
+                try: found.append(json.loads(line))
+                except ValueError: continue
+        return found
+
+    @staticmethod
+    def _apply(state, entry):
+        if entry['op'] in ('checkpoint', 'clear'): state.clear()
+        for date, digest in entry['rows'].items():
+            if digest is None: state.pop(date, None)
+            else: state[date] = digest
+
+    @classmethod
+    def _fold(cls, entries):
+        """把日誌重播成 {date: hash}"""
+        state = {}
+        for entry in entries: cls._apply(state, entry)
+        return state
+
+    def _append(self, op, rows, entries):
+        entry = {
+            'seq': (entries[-1]['seq'] + 1) if entries else 1,
+            'ts': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'op': op,
+            'rows': rows,
+        }
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._journal_path(), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if len(entries) + 1 > self.max_entries: self.prune()
+        return entry
+
+    def _records(self, df):
+        df = normalize_records(df).drop_duplicates('date', keep='last')
+        return {rec['date']: rec for rec in df.to_dict('records')}
+
+    def ensure_baseline(self, current_df):
+        """日誌是空的時候先把目前的資料庫完整存一次，當作第一個還原點"""
+        with _JOURNAL_LOCK:
+            if self.entries() or current_df.empty: return
+            rows = {date: self._put_row(rec) for date, rec in self._records(current_df).items()}
+            self._append('checkpoint', rows, [])
+
+    def record_upsert(self, new_df):
+        """save_batch_data：只備份這次新增/更新的日期 (內容沒變的不記)"""
+        with _JOURNAL_LOCK:
+            entries = self.entries()
+            state = self._fold(entries)
+            rows = {}
+            for date, rec in self._records(new_df).items():
+                digest = self._digest(rec)
+                if state.get(date) != digest: rows[date] = self._put_row(rec)
+            if rows: return self._append('upsert', rows, entries)
+
+    def record_replace(self, full_df):
+        """save_full_history：與上一版比對，只記有變動或被刪除的日期"""
+        with _JOURNAL_LOCK:
+            entries = self.entries()
+            state = self._fold(entries)
+            records = self._records(full_df)
+            rows = {}
+            for date, rec in records.items():
+                digest = self._digest(rec)
+                if state.get(date) != digest: rows[date] = self._put_row(rec)
+            for date in state:
+                if date not in records: rows[date] = None
+            if rows: return self._append('replace', rows, entries)
+
+    def record_clear(self):
+        with _JOURNAL_LOCK:
+            entries = self.entries()
+            if entries and self._fold(entries): return self._append('clear', {}, entries)
+
+    # --- 還原 ---
+    def restore_points(self):
+        """還原點清單 (新到舊)：seq, ts, op, 變動筆數, 當時總筆數"""
+        points = []
+        state = {}
+        for entry in self.entries():
+            self._apply(state, entry)
+            points.append({'seq': entry['seq'], 'ts': entry['ts'], 'op': entry['op'], 'changed': len(entry['rows']), 'total': len(state)})
+        return pd.DataFrame(points[::-1], columns=['seq', 'ts', 'op', 'changed', 'total'])
+
+    def snapshot(self, seq=None, at=None):
+        """
+        還原某個時間點的資料庫。
+        Args:
+            seq: 重播到第幾筆日誌 (含)
+            at: 或指定時間 'YYYY-MM-DD HH:MM:SS'，重播到該時間以前的最後一筆
+        """
+        entries = self.entries()
+        if seq is not None: entries = [e for e in entries if e['seq'] <= seq]
+        if at is not None: entries = [e for e in entries if e['ts'] <= at]
+        state = self._fold(entries)
+        if not state: return pd.DataFrame()
+        df = pd.DataFrame([self._get_row(digest) for digest in state.values()])
+        return df.sort_values('date', ascending=False).reset_index(drop=True)
+
+    # --- 清理 ---
+    def prune(self):
+        """把超過保留期限的紀錄折疊成 checkpoint，並刪掉沒人引用的資料檔"""
+        with _JOURNAL_LOCK:
+            entries = self.entries()
+            cutoff = (datetime.now() - timedelta(days=self.keep_days)).strftime("%Y-%m-%d %H:%M:%S")
+            old = [e for e in entries if e['ts'] < cutoff]
+            keep = entries[len(old):]
+            # 期限內的還原點太多時，只保留最近 max_entries 筆
+            if len(keep) > self.max_entries:
+                old, keep = entries[:len(entries) - self.max_entries], entries[len(entries) - self.max_entries:]
+            if len(old) <= 1 and (not old or old[0]['op'] == 'checkpoint'): return 0
+            base = {'seq': old[-1]['seq'], 'ts': old[-1]['ts'], 'op': 'checkpoint', 'rows': self._fold(old)}
+            new_entries = [base] + keep
+            data = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in new_entries)
+            atomic_write_bytes(self._journal_path(), data.encode('utf-8'))
+
+            live = {d for e in new_entries for d in e['rows'].values() if d}
+            objects_root = os.path.join(self.root, OBJECTS_DIR)
+            removed = 0
+            for dir_path, _, file_names in os.walk(objects_root):
+                for name in file_names:
+                    if name.endswith('.json.gz') and name[:-len('.json.gz')] not in live:
+                        os.remove(os.path.join(dir_path, name))
+                        removed += 1
+            return removed
@@ -0,0 +1,80 @@
+# --- 風箏戰情室：風度循環分段 (Cycle segmentation) ---
+# 把歷史檔的每一天分成 積極 (active) / 保守 (passive) / 交界 (transition)，
+# 連續同一種循環的日子合成一個區段，算出每段的起訖日與區間報酬。
+# 全部用 numpy 向量運算 (diff 找切點)，結果以歷史檔指紋快取；槓桿倍數只是在平均報酬上乘一個純量。
+# 本模組不依賴 Streamlit。
+import numpy as np
+import pandas as pd
+
+CYCLE_TYPES = ['active', 'passive', 'transition']
+WIND_KEYWORDS = ['強風', '亂流', '無風', '陣風']
+
+
+def _contains(values, word):
+    return values.str.contains(word, regex=False).to_numpy(dtype=bool)
+
+
+def classify_cycles(hist_df):
+    """
+    每一天的循環 (active / passive / transition)。
+    有「行情方向」欄時：同時含 強風+亂流 -> active，同時含 無風+陣風 -> passive；
+    沒有時看風度：只含 強風/亂流 -> active，只含 無風/陣風 -> passive；其他都是 transition。
+    """
+    target_col = next((c for c in hist_df.columns if '行情' in c or '方向' in c), None)
+    if target_col:
+        values = hist_df[target_col].astype(str).str.strip()
+        active = _contains(values, '強風') & _contains(values, '亂流')
+        passive = ~active & _contains(values, '無風') & _contains(values, '陣風')
+    else:
+        values = hist_df['風度'].fillna('').astype(str).str.strip()
+        has_act = _contains(values, '強風') | _contains(values, '亂流')
+        has_pass = _contains(values, '無風') | _contains(values, '陣風')
+        active = has_act & ~has_pass
+        passive = has_pass & ~has_act
+    return np.where(active, 'active', np.where(passive, 'passive', 'transition')).astype(object)
+
+
+def segment_cycles(hist_df):
+    """
+    歷史檔 (日期由舊到新，e.g. history_frame 的結果) -> 循環分析結果 (不修改傳入的資料表)
+    Returns:
+        dict:
+            frame: 日期, 收, MA20, wind_clean, cycle (畫圖用)
+            zones: 每個區段一列 start, end, type, start_price, end_price, return (%)
+                   end 是下一段的第一天 (最後一段為最後一天 +1)，return 以該段第一天與最後一天的收盤計算
+            days: {循環: 天數}    wind_counts: {風度: 天數}
+            avg_return: {循環: 各段報酬的平均 (%)，未乘槓桿}
+    """
+    if hist_df.empty: return None
+    dates = pd.DatetimeIndex(hist_df['日期']).to_numpy(dtype='datetime64[ns]')
+    close = pd.to_numeric(hist_df['收'], errors='coerce').to_numpy(dtype=np.float64)
+    col_20ma = next((c for c in hist_df.columns if '20ma' in c.lower().replace(' ', '')), None)
+    # 若沒有 20MA 欄位則自動計算
+    ma20 = pd.to_numeric(hist_df[col_20ma], errors='coerce') if col_20ma else pd.Series(close).rolling(window=20, min_periods=1).mean()
+    wind_clean = hist_df['風度'].fillna('').astype(str).str.strip()
+    cycle = classify_cycles(hist_df)
+
+    # --- 找切點：循環和前一天不同的位置就是新區段的開始 ---
+    n = len(cycle)
+    change = np.ones(n, dtype=bool)
+    change[1:] = cycle[1:] != cycle[:-1]
+    starts = np.flatnonzero(change)
+    last_rows = np.append(starts[1:] - 1, n - 1)
+    end_dates = np.append(dates[starts[1:]], dates[-1] + np.timedelta64(1, 'D'))
+    start_price, end_price = close[starts], close[last_rows]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.where(start_price > 0, (end_price - start_price) / start_price * 100, 0.0)
+
+    zones = pd.DataFrame({
+        'start': dates[starts], 'end': end_dates, 'type': cycle[starts],
+        'start_price': start_price, 'end_price': end_price, 'return': returns,
+    })
+    avg_return = zones.groupby('type')['return'].mean().reindex(CYCLE_TYPES).fillna(0.0).to_dict()
+    days = pd.Series(cycle).value_counts().reindex(CYCLE_TYPES, fill_value=0).astype(int).to_dict()
+    wind_counts = {w: int(_contains(wind_clean, w).sum()) for w in WIND_KEYWORDS}
+
+    frame = pd.DataFrame({
+        '日期': dates, '收': close, 'MA20': np.asarray(ma20, dtype=np.float64),
+        'wind_clean': wind_clean.to_numpy(dtype=object), 'cycle': cycle,
+    })
+    return {'frame': frame, 'zones': zones, 'days': days, 'wind_counts': wind_counts, 'avg_return': avg_return}
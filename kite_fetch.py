@@ -0,0 +1,348 @@
+# --- 風箏戰情室：並行抓取 (共用有上限的 thread pool + 每項期限 + 最後一次成功值) ---
+# 報價、走勢圖這類網路請求一項一項排隊抓，最慢的那幾個會把整頁拖住。
+# fetch_all 把所有項目一次丟進共用的 thread pool，最多等 budget 秒：
+#     期限內完成的直接用；逾時或失敗的改用 LastGood 裡「上一次成功的值」，整體等待時間有上限。
+# 每個工作會拿到一個 Deadline，多段補救 (e.g. 1d -> 5d -> 1mo) 之間可以檢查剩餘時間、提早放棄。
+# BackgroundRefresher：整個 process 只有一個背景 thread 定時抓取，把結果發布成不可變的 Snapshot；
+# 頁面只讀最新的 Snapshot，永遠不等網路，也不會因為很多人同時打開而重複抓取。
+# IndexQuoteProvider：單一指數報價依宣告的順序一路補救 (e.g. 官方 MIS -> fast_info -> 日線)，
+# 同一個代號同時只會有一個請求在跑 (Coalescer)，其他呼叫者等同一個結果；max_age 內再問拿到的是同一筆報價。
+# CircuitBreaker：每個外部來源一個熔斷器。連續失敗 threshold 次就停用 cooldown 秒 (直接回傳預設值，不再等逾時)，
+# 之後只放一個試探請求；單次失敗也會記住 negative_ttl 秒 (負向快取)。circuit_states() 給後台診斷頁用。
+# 本模組不依賴 Streamlit。
+import time
+import threading
+from types import MappingProxyType
+from typing import NamedTuple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, wait
+
+MAX_WORKERS = 10
+FETCH_BUDGET = 6.0  # 秒
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def shared_pool():
+    """整個 process 共用一個 pool：逾時還沒做完的工作留在背景收尾，不會無限制地開新 thread"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='kite-fetch')
+        return _POOL
+
+
+class Deadline:
+    """單一工作的截止時間 (monotonic clock)"""
+
+    def __init__(self, seconds):
+        self.at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class LastGood:
+    """每個 key 最後一次成功的結果 (thread-safe)，抓取逾時 / 失敗時拿來補位"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time())
+
+    def get(self, key):
+        """回傳 (value, 存入時間 epoch 秒)；沒有紀錄時回傳 (None, None)"""
+        with self._lock:
+            return self._data.get(key, (None, None))
+
+
+def fetch_all(tasks, budget=FETCH_BUDGET, last_good=None, pool=None):
+    """
+    並行執行 tasks，最多等 budget 秒。
+    Args:
+        tasks: {key: fn(deadline)}；fn 回傳 None 代表沒抓到資料
+        last_good: LastGood；成功的結果會存進去，逾時 / 失敗 / 回傳 None 時拿上一次的值補上
+    Returns:
+        (results, status)
+            results: {key: value}，依 tasks 的順序；連上一次的值都沒有的 key 不會出現
+            status: {key: 'ok' / 'stale' / 'timeout' / 'error' / 'empty'}
+    """
+    pool = pool or shared_pool()
+    deadline = Deadline(budget)
+    futures = {key: pool.submit(fn, deadline) for key, fn in tasks.items()}
+    wait(futures.values(), timeout=budget)
+
+    results, status = {}, {}
+    for key, future in futures.items():
+        value, state = None, 'timeout'
+        if future.done():
+            try:
+                value = future.result()
+                state = 'ok' if value is not None else 'empty'
+            except Exception as e:
+                print(f"Fetch Error ({key}): {e}")
+                state = 'error'
+        else:
+            future.cancel()  # 還在排隊的就不必再跑
+        if state == 'ok':
+            if last_good is not None: last_good.put(key, value)
+            results[key] = value
+        elif last_good is not None:
+            stale, _ = last_good.get(key)
+            if stale is not None:
+                results[key] = stale
+                state = 'stale'
+        status[key] = state
+    return results, status
+
+
+# --- 背景定時更新 + 不可變快照 ---
+def freeze(obj):
+    """dict -> MappingProxyType、list -> tuple (遞迴)：發布出去的快照任何 session 都改不到"""
+    if isinstance(obj, dict): return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)): return tuple(freeze(v) for v in obj)
+    return obj
+
+
+class Snapshot(NamedTuple):
+    data: object        # freeze() 過的資料
+    fetched_at: float   # epoch 秒
+    status: object      # {key: 'ok' / 'stale' / ...}
+
+
+class BackgroundRefresher:
+    """
+    背景 thread 每 interval 秒呼叫一次 produce() -> (data, status)，發布成新的 Snapshot (整個換掉，不修改舊的)。
+    latest() 只讀目前的參照，不上鎖也不等網路；第一次抓完以前回傳 None。
+    stop() 之後 thread 在這一輪做完就結束，不再重新啟動。
+    """
+
+    def __init__(self, produce, interval, name='kite-refresher'):
+        self.produce = produce
+        self.interval = interval
+        self.name = name
+        self._snapshot = None
+        self._wake = threading.Event()
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._stopped.is_set(): return self
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        """停掉背景 thread (不等它結束)；正在等下一輪的話立刻醒來離開"""
+        self._stopped.set()
+        self._wake.set()
+
+    def latest(self):
+        return self._snapshot
+
+    def refresh_now(self):
+        """提早做下一輪 (不等結果)"""
+        self._wake.set()
+
+    def wait_ready(self, timeout):
+        """等第一份快照 (最多 timeout 秒)；回傳是否已有快照"""
+        return self._ready.wait(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                data, status = self.produce()
+                self._snapshot = Snapshot(freeze(data), time.time(), freeze(status))
+                self._ready.set()
+            except Exception as e:
+                print(f"Refresher Error ({self.name}): {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+# --- 請求合併 + 指數報價補救鏈 ---
+class Coalescer:
+    """
+    同一個 key 同時只跑一次 fn：第一個呼叫者負責抓，其他人等同一個 Future。
+    成功的結果保留 max_age 秒，期間內再問直接回傳同一份；None / 空 dict 這類空值 (來源失敗時的回傳) 不保留。
+    """
+
+    def __init__(self, max_age=0.0):
+        self.max_age = max_age
+        self._inflight = {}
+        self._done = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, timeout=None):
+        """等候者超過 timeout 秒會丟出 TimeoutError (負責抓的那個會照樣做完)"""
+        with self._lock:
+            hit = self._done.get(key)
+            if hit is not None and time.monotonic() - hit[1] < self.max_age: return hit[0]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+        if not leader: return future.result(timeout)
+
+        value = None
+        try:
+            value = fn()
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if value: self._done[key] = (value, time.monotonic())
+
+
+class Quote(NamedTuple):
+    price: float
+    change: float
+    pct_change: float
+    source: str         # 補救鏈中實際給出報價的那一步
+    fetched_at: float   # epoch 秒
+
+
+class IndexQuoteProvider:
+    """
+    chain: [(名稱, fn(symbol, deadline) -> (price, change, pct_change) 或 None), ...]，依序嘗試直到有結果。
+    同一個代號的並行請求合併成一次；max_age 秒內重複詢問拿到同一筆 Quote (一輪更新內報價一致)。
+    """
+
+    def __init__(self, chain, max_age=0.0):
+        self.chain = list(chain)
+        self._coalescer = Coalescer(max_age)
+
+    def get(self, symbol, deadline=None):
+        """回傳 Quote；補救鏈全部失敗或等超過 deadline 時回傳 None"""
+        deadline = deadline or Deadline(FETCH_BUDGET)
+        try:
+            return self._coalescer.run(symbol, lambda: self._fetch(symbol, deadline), timeout=deadline.remaining())
+        except TimeoutError:
+            return None
+
+    def _fetch(self, symbol, deadline):
+        for name, fn in self.chain:
+            if deadline.expired(): break
+            try:
+                value = fn(symbol, deadline)
+            except Exception as e:
+                print(f"Quote Error ({symbol} / {name}): {e}")
+                value = None
+            if value is not None: return Quote(*value, source=name, fetched_at=time.time())
+        return None
+
+
+# --- 熔斷器 (每個外部來源一個) ---
+class CircuitBreaker:
+    """
+    closed (正常) -> 連續失敗 threshold 次 -> open (cooldown 秒內全部跳過)
+    -> half-open (放一個試探請求：成功回到 closed，失敗再 open 一輪)。
+    還沒到 threshold 的單次失敗也會擋 negative_ttl 秒 (負向快取，0 = 不擋)。
+    """
+
+    def __init__(self, name, threshold=3, cooldown=60.0, negative_ttl=0.0):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.negative_ttl = negative_ttl
+        self.failures = 0           # 連續失敗次數
+        self.blocked_until = 0.0    # monotonic
+        self.probing = False
+        self.last_error = None
+        self.last_failure_at = None  # epoch 秒
+        self.last_success_at = None  # epoch 秒
+        self.calls = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.threshold: return 'closed'
+        return 'open' if time.monotonic() < self.blocked_until or self.probing else 'half-open'
+
+    def allow(self):
+        """這次可不可以打出去；不行時計入 skipped"""
+        with self._lock:
+            if time.monotonic() < self.blocked_until or self.probing:
+                self.skipped += 1
+                return False
+            if self.failures >= self.threshold: self.probing = True  # half-open：只放這一個
+            self.calls += 1
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures, self.blocked_until, self.probing = 0, 0.0, False
+            self.last_success_at = time.time()
+
+    def failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            self.last_error = str(error)[:200]
+            self.last_failure_at = time.time()
+            hold = self.cooldown if self.failures >= self.threshold else self.negative_ttl
+            self.blocked_until = time.monotonic() + hold
+
+    def call(self, fn, *args, default=None, failed=None, **kwargs):
+        """
+        透過熔斷器呼叫 fn(*args, **kwargs)。
+        熔斷中直接回傳 default；fn 丟例外算失敗 (例外照樣往上丟)，failed(結果) 為 True 也算失敗 (結果照樣回傳)。
+        """
+        if not self.allow(): return default
+        try:
+            value = fn(*args, **kwargs)
+        except Exception as e:
+            self.failure(e)
+            raise
+        if failed is not None and failed(value): self.failure('回應無效')
+        else: self.success()
+        return value
+
+    def reset(self):
+        with self._lock:
+            self.failures, self.blocked_until, self.probing = 0, 0.0, False
+
+    def describe(self):
+        """診斷用的一列資料"""
+        with self._lock:
+            remaining = max(self.blocked_until - time.monotonic(), 0.0)
+            return {
+                'source': self.name, 'state': self.state, 'failures': self.failures,
+                'blocked_for': round(remaining, 1), 'calls': self.calls, 'skipped': self.skipped,
+                'last_error': self.last_error, 'last_failure_at': self.last_failure_at,
+                'last_success_at': self.last_success_at,
+            }
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def circuit(name, **options):
+    """取得 (第一次則建立) 名為 name 的熔斷器；options 只在建立時生效"""
+    with _BREAKERS_LOCK:
+        if name not in _BREAKERS: _BREAKERS[name] = CircuitBreaker(name, **options)
+        return _BREAKERS[name]
+
+
+def circuit_states():
+    """所有熔斷器目前的狀態 (list of dict，依建立順序)"""
+    with _BREAKERS_LOCK:
+        breakers = list(_BREAKERS.values())
+    return [b.describe() for b in breakers]
@@ -0,0 +1,175 @@
+# --- 風箏戰情室：標準化記憶體資料表 (Canonical frame) ---
+# load_db 讀出來的是「存檔格式」(日期是字串、風度是自由文字)；儀表板需要的日期解析、月份字串、
+# 風度分類都在這裡一次做完，之後各區塊直接取用，不再各自 to_datetime / strftime。
+# 本模組不依賴 Streamlit。
+from typing import TypedDict
+
+import numpy as np
+import pandas as pd
+
+from kite_store import NUMERIC_COLS, LIST_COLS
+from kite_sqlite import split_stocks, explode_lists, STRATEGY_LABELS
+
+WIND_ORDER = ['強風', '亂流', '陣風', '無風']
+
+
+def parse_dates(date_series):
+    """'2025-12-04' / '2025 12-04' / '2025/12/04' -> datetime64 (無法解析的變 NaT)"""
+    return pd.to_datetime(date_series.astype(str).str.strip(), format='mixed', errors='coerce')
+
+
+def canonical_frame(df):
+    """
+    原始資料表 -> 標準表 (載入時只做一次，之後唯讀使用)
+        index: dt (datetime64，舊到新排序，無法解析的日期會被丟掉)
+        date: 原始日期字串 (存檔用的 key，保持不變)
+        compare_date: 'YYYY-MM-DD'   Month: 'YYYY-MM'
+        wind: 分類型 (強風/亂流/陣風/無風 + 其他出現過的值)
+        *_count: int    *_list / manual_turnover: str
+    """
+    if df.empty or 'date' not in df.columns: return pd.DataFrame()
+    dt = parse_dates(df['date'])
+    out = df.loc[dt.notna().to_numpy()].copy()
+    out.index = pd.DatetimeIndex(dt[dt.notna()].to_numpy(), name='dt')
+    out = out.sort_index(kind='stable')
+
+    for col in NUMERIC_COLS:
+        if col in out.columns: out[col] = pd.to_numeric(out[col], errors='coerce').fillna(0).astype(int)
+    for col in LIST_COLS + ['last_updated', 'manual_turnover']:
+        if col in out.columns: out[col] = out[col].fillna('').astype(str).replace('nan', '')
+
+    if 'wind' in out.columns:
+        wind = out['wind'].fillna('').astype(str).str.strip()
+        extra = sorted(set(wind.unique()) - set(WIND_ORDER))
+        out['wind'] = pd.Categorical(wind, categories=WIND_ORDER + extra)
+
+    out['compare_date'] = out.index.strftime('%Y-%m-%d')
+    out['Month'] = out.index.strftime('%Y-%m')
+    return out
+
+
+# --- 單日檢視資料 (view-model)：日期選擇器直接查 dict，不必每次掃整張表 ---
+class DayView(TypedDict):
+    date: str; compare_date: str; wind: str; wind_streak: int
+    part_time_count: int; worker_strong_count: int; worker_trend_count: int
+    worker_strong_list: str; worker_trend_list: str; boss_pullback_list: str
+    boss_bargain_list: str; top_revenue_list: str
+    last_updated: str; manual_turnover: str
+    picks: dict  # 策略欄位 -> [(名稱, 代號, 是否CB), ...]
+    codes: dict  # 標籤名稱 (去掉 (CB) / *) -> 代號
+
+
+class WindRuns:
+    """
+    風度序列的 run-length 編碼：連續相同風度的日子合成一段 (依日期由舊到新)。
+        starts / ends: 每段的第一天 / 最後一天   labels: 每段的風度   lengths: 每段幾個交易日
+    資料版本不變就重複使用；查某天的連續天數只要兩次二分搜尋。
+    """
+
+    def __init__(self, dates, winds):
+        dates = pd.DatetimeIndex(dates).to_numpy(dtype='datetime64[ns]')
+        winds = pd.Series(winds).astype(str).str.replace("(CB)", "", regex=False).str.strip().to_numpy(dtype=object)
+        order = np.argsort(dates, kind='stable')
+        self.dates, winds = dates[order], winds[order]
+        n = len(winds)
+        change = np.ones(n, dtype=bool)
+        change[1:] = winds[1:] != winds[:-1]
+        self.run_pos = np.flatnonzero(change)  # 每段第一天在序列中的位置
+        self.labels = winds[self.run_pos]
+        self.lengths = np.diff(np.append(self.run_pos, n))
+        self.starts = self.dates[self.run_pos]
+        self.ends = self.dates[self.run_pos + self.lengths - 1]
+
+    def __len__(self):
+        return len(self.dates)
+
+    def at(self, date):
+        """
+        截至 date (含) 的風度狀態。
+        Returns:
+            (風度, 連續天數, 該段起始日)；date 早於第一筆資料時回傳 ('', 0, None)
+        """
+        i = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(date), 'ns'), side='right') - 1
+        if i < 0: return '', 0, None
+        k = np.searchsorted(self.run_pos, i, side='right') - 1
+        return self.labels[k], int(i - self.run_pos[k] + 1), pd.Timestamp(self.starts[k])
+
+    def latest(self):
+        return self.at(self.dates[-1]) if len(self) else ('', 0, None)
+
+    def streaks(self):
+        """每一天 (依日期排序後) 的風度已連續幾天"""
+        run_id = np.repeat(np.arange(len(self.run_pos)), self.lengths)
+        return np.arange(len(self.dates)) - self.run_pos[run_id] + 1
+
+    def runs(self):
+        """每一段一列 (start, end, wind, days)，畫圖標示區段用"""
+        return pd.DataFrame({'start': self.starts, 'end': self.ends, 'wind': self.labels, 'days': self.lengths})
+
+
+def merge_same_day(frame):
+    """
+    標準表裡正規化後是同一天的多列 (e.g. '2024/1/5' 與 '2024-01-05') 合成一列：
+    選股清單依序合併去重、數字欄位取最大、其他欄位取最後一個非空值 (date 留最後一列的原始字串)。
+    沒有重複日期時原樣回傳。
+    """
+    if not frame.index.has_duplicates: return frame
+
+    def union(values):
+        return '、'.join(dict.fromkeys(stock for v in values for stock in split_stocks(v)))
+
+    def last_filled(values):
+        filled = values[values.astype(str).str.strip() != '']
+        return filled.iloc[-1] if len(filled) else ''
+
+    agg = {col: 'max' if col in NUMERIC_COLS else union if col in LIST_COLS else last_filled for col in frame.columns}
+    return frame.groupby(level=0, sort=True).agg(agg)
+
+
+def build_day_views(frame, resolve=None):
+    """
+    標準表 -> {compare_date: DayView} (日期由舊到新)；同一天的多列先以 merge_same_day 合併
+    resolve: 名稱 -> (code, name, sector) 的查找函式；None 代表不解析代號
+    """
+    if frame.empty: return {}
+    frame = merge_same_day(frame)
+    for col in NUMERIC_COLS + LIST_COLS + ['last_updated', 'manual_turnover']:
+        if col not in frame.columns: frame = frame.assign(**{col: 0 if col in NUMERIC_COLS else ''})
+    streaks = WindRuns(frame.index, frame['wind']).streaks()
+    code_cache = {}
+
+    def lookup(name):
+        if name not in code_cache:
+            code_cache[name] = resolve(name)[0] if resolve is not None else None
+        return code_cache[name]
+
+    views = {}
+    cols = ['date', 'compare_date', 'wind'] + NUMERIC_COLS + LIST_COLS + ['last_updated', 'manual_turnover']
+    for streak, row in zip(streaks, frame[cols].itertuples(index=False)):
+        rec = row._asdict()
+        picks, codes = {}, {}
+        for col in LIST_COLS:
+            picks[col] = []
+            for stock in split_stocks(rec[col]):
+                name = stock.replace("(CB)", "").strip()
+                code = lookup(name)
+                picks[col].append((name, code, "(CB)" in stock))
+                codes[stock.replace("(CB)", "").replace("*", "")] = code
+        views[rec['compare_date']] = DayView(
+            **{k: rec[k] for k in ['date', 'compare_date', 'last_updated', 'manual_turnover'] + LIST_COLS},
+            **{k: int(rec[k]) for k in NUMERIC_COLS},
+            wind=str(rec['wind']), wind_streak=int(streak), picks=picks, codes=codes,
+        )
+    return views
+
+
+# --- 策略選股攤平：五個策略欄位一次 melt + explode (與 SQLite 索引共用 explode_lists) ---
+def explode_picks(frame, labels=STRATEGY_LABELS):
+    """
+    標準表 -> 一檔選股一列 (dt, Month, Strategy, stock)；Strategy 是欄位名稱 (e.g. 'worker_strong_list')
+    不修改傳入的資料表。
+    """
+    cols = [c for c in labels if c in frame.columns]
+    if frame.empty or not cols: return pd.DataFrame(columns=['dt', 'Month', 'Strategy', 'stock'])
+    long = explode_lists(frame[['Month'] + cols].rename_axis('dt').reset_index(), ['dt', 'Month'], cols)
+    return long.rename(columns={'strategy': 'Strategy'})[['dt', 'Month', 'Strategy', 'stock']]
@@ -0,0 +1,223 @@
+# --- 風箏戰情室：風度歷史檔的二進位快取 (kite_history.csv / kite_history_taiex.csv) ---
+# 後台上傳歷史檔時，順便把它轉成幾個 numpy 陣列 (日期、收盤、20MA、乖離率、風度代碼、行情方向代碼)，
+# 儀表板用 np.load(mmap_mode='r') 唯讀映射進來：不必每次重新解析 CSV，多個 process 也共用同一份 page cache。
+# 上傳時用 import_history_csv 串流匯入 (檔頭判斷編碼、分塊解析並檢查欄位)，不必對整份檔案反覆試編碼。
+# 快取目錄：kite_history.csv -> kite_history_npy/
+#     meta.json                 <- 目前版本 (token)、來源 CSV 指紋、風度 / 方向的代碼表
+#     dates.<token>.npy ...     <- 寫入後不再修改；換新版時先寫新檔，最後才原子替換 meta.json
+# 本模組不依賴 Streamlit。
+import io
+import os
+import json
+import time
+import codecs
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from kite_store import atomic_write_bytes, atomic_write_csv, file_fingerprint
+
+WIND_LABELS = ['強風', '亂流', '陣風', '無風']
+ARRAY_NAMES = ['dates', 'close', 'ma20', 'bias', 'wind', 'direction']
+META_FILE = 'meta.json'
+
+
+def default_cache_dir(csv_path):
+    """kite_history.csv -> kite_history_npy"""
+    stem, _ = os.path.splitext(csv_path)
+    return f"{stem}_npy"
+
+
+def _encode_labels(values, base_labels=()):
+    """文字欄位 -> (int8 代碼, 代碼表)；代碼表以 base_labels 開頭，其餘依出現值排序"""
+    values = values.fillna('').astype(str).str.strip()
+    labels = list(base_labels) + sorted(set(values.unique()) - set(base_labels))
+    codes = pd.Categorical(values, categories=labels).codes.astype(np.int8)
+    return codes, labels
+
+
+def _to_float(series):
+    return pd.to_numeric(series.astype(str).str.replace(',', '', regex=False).str.replace('%', '', regex=False).str.strip(), errors='coerce')
+
+
+def history_arrays_from_frame(df):
+    """
+    歷史檔 DataFrame (日期, 風度, 收, [20MA], [乖離率], [行情方向]) -> (arrays, meta)
+    日期格式以 YYYY.MM.DD 為主，其他格式再用 mixed 補解析；無法解析的列丟掉，依日期排序。
+    """
+    df = df.rename(columns=lambda c: str(c).strip())
+    dates = pd.to_datetime(df['日期'].astype(str).str.strip(), format='%Y.%m.%d', errors='coerce')
+    missing = dates.isna()
+    if missing.any():
+        dates[missing] = pd.to_datetime(df.loc[missing, '日期'].astype(str).str.strip(), format='mixed', errors='coerce')
+    df = df.assign(_dt=dates).dropna(subset=['_dt']).sort_values('_dt', kind='stable').reset_index(drop=True)
+
+    close = _to_float(df['收']) if '收' in df.columns else pd.Series(np.nan, index=df.index)
+    col_20ma = next((c for c in df.columns if '20ma' in c.lower().replace(' ', '')), None)
+    ma20 = _to_float(df[col_20ma]) if col_20ma else close.rolling(window=20, min_periods=1).mean()
+    bias = _to_float(df['乖離率']) if '乖離率' in df.columns else pd.Series(np.nan, index=df.index)
+    wind, wind_labels = _encode_labels(df['風度'], WIND_LABELS)
+    direction_col = next((c for c in df.columns if '行情' in c or '方向' in c), None)
+    if direction_col: direction, direction_labels = _encode_labels(df[direction_col])
+    else: direction, direction_labels = np.full(len(df), -1, dtype=np.int8), []
+
+    arrays = {
+        'dates': df['_dt'].to_numpy(dtype='datetime64[D]'),
+        'close': close.to_numpy(dtype=np.float64),
+        'ma20': ma20.to_numpy(dtype=np.float64),
+        'bias': bias.to_numpy(dtype=np.float64),
+        'wind': wind,
+        'direction': direction,
+    }
+    meta = {
+        'rows': len(df),
+        'wind_labels': wind_labels,
+        'direction_labels': direction_labels,
+        'direction_column': direction_col,
+    }
+    return arrays, meta
+
+
+def read_history_csv(csv_path):
+    with open(csv_path, 'rb') as f:
+        encoding = sniff_encoding(f.read(SNIFF_BYTES))
+    return pd.read_csv(csv_path, encoding=encoding)
+
+
+def build_history_cache(csv_path, df=None, cache_dir=None):
+    """
+    把歷史檔轉成 .npy 快取 (後台上傳後呼叫)。
+    df: 已經解析好的 DataFrame (上傳時已讀過就不必再讀一次 CSV)
+    """
+    cache_dir = cache_dir or default_cache_dir(csv_path)
+    if df is None: df = read_history_csv(csv_path)
+    arrays, meta = history_arrays_from_frame(df)
+    source = list(file_fingerprint(csv_path)[1:])
+    token = hashlib.sha1(json.dumps([source, meta['rows']]).encode('utf-8')).hexdigest()[:12]
+    for name, arr in arrays.items():
+        buf = io.BytesIO()
+        np.save(buf, arr, allow_pickle=False)
+        atomic_write_bytes(os.path.join(cache_dir, f"{name}.{token}.npy"), buf.getvalue())
+    meta.update({'token': token, 'source': source})
+    atomic_write_bytes(os.path.join(cache_dir, META_FILE), json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+    # 舊版本檔案直接刪掉：已經 mmap 的 process 仍可讀到 (POSIX unlink 語意)
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npy') and f".{token}." not in name:
+            try: os.remove(os.path.join(cache_dir, name))
+            except OSError: pass
+    return meta
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_history_arrays(csv_path, cache_dir=None):
+    """
+    唯讀映射歷史快取，回傳 (arrays, meta)；快取不存在或 CSV 被換過 (指紋不同) 時先重建。
+    CSV 與快取都沒有時回傳 (None, None)。
+    """
+    cache_dir = cache_dir or default_cache_dir(csv_path)
+    meta = _read_meta(cache_dir)
+    source = file_fingerprint(csv_path)[1:]
+    csv_exists = source[0] is not None
+    if csv_exists and (meta is None or meta.get('source') != list(source)):
+        meta = build_history_cache(csv_path, cache_dir=cache_dir)
+    if meta is None: return None, None
+    arrays = {
+        name: np.load(os.path.join(cache_dir, f"{name}.{meta['token']}.npy"), mmap_mode='r', allow_pickle=False)
+        for name in ARRAY_NAMES
+    }
+    return arrays, meta
+
+
+def history_frame(arrays, meta):
+    """
+    快取陣列 -> 與原本 CSV 相同欄名的 DataFrame (日期, 風度, 收, 20MA, 乖離率, 行情方向)
+    數值欄直接引用 mmap 陣列 (不複製)；乖離率是數字 (% 已去掉)。
+    """
+    if arrays is None or meta['rows'] == 0: return pd.DataFrame()
+    data = {
+        '日期': pd.DatetimeIndex(arrays['dates']).astype('datetime64[ns]'),
+        '風度': np.asarray(meta['wind_labels'], dtype=object)[arrays['wind']],
+        '收': arrays['close'],
+        '20MA': arrays['ma20'],
+        '乖離率': arrays['bias'],
+    }
+    if meta['direction_labels']:
+        data[meta['direction_column']] = np.asarray(meta['direction_labels'], dtype=object)[arrays['direction']]
+    return pd.DataFrame(data, copy=False)
+
+
+# --- 串流匯入：先從檔頭判斷編碼，再分塊解析 (大檔上傳時不會整份重讀好幾次) ---
+REQUIRED_COLUMNS = ['日期', '風度', '收', '乖離率']
+SNIFF_BYTES = 64 * 1024
+CHUNK_ROWS = 20000
+
+
+def sniff_encoding(sample):
+    """由檔頭 bytes 判斷編碼：有 BOM -> utf-8-sig；能以 UTF-8 解碼 -> utf-8；否則視為 Big5 (cp950)"""
+    if sample.startswith(b'\xef\xbb\xbf'): return 'utf-8-sig'
+    try:
+        # final=False：取樣可能剛好切在一個多位元組字的中間
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp950'
+
+
+def import_history_csv(fileobj, csv_path, chunk_rows=CHUNK_ROWS, progress=None):
+    """
+    串流匯入歷史檔：判斷編碼 -> 分塊解析並檢查欄位 -> 存成 CSV (utf-8-sig) -> 建 .npy 快取
+    Args:
+        fileobj: 二進位檔案物件 (st.file_uploader 的回傳值)
+        progress: callback(已讀列數, 已讀 bytes 比例)，每讀完一塊呼叫一次
+    Returns:
+        dict: encoding, rows, lenient_dates (不是 YYYY.MM.DD、改用 mixed 解析成功而保留的列),
+              bad_dates (怎樣都無法解析、建快取時丟掉的列), seconds, rows_per_sec
+    Raises:
+        ValueError: 缺少必要欄位 / 檔案是空的
+    """
+    started = time.perf_counter()
+    fileobj.seek(0, os.SEEK_END); total_bytes = fileobj.tell() or 1
+    fileobj.seek(0)
+    encoding = sniff_encoding(fileobj.read(SNIFF_BYTES))
+    fileobj.seek(0)
+
+    text = io.TextIOWrapper(fileobj, encoding=encoding, newline='')
+    chunks, rows, lenient_dates, bad_dates = [], 0, 0, 0
+    try:
+        for chunk in pd.read_csv(text, chunksize=chunk_rows, dtype=str, keep_default_na=False):
+            chunk.columns = chunk.columns.str.strip()
+            if not chunks:
+                missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+                if missing: raise ValueError(f"缺少必要欄位: {', '.join(missing)} (編碼: {encoding})")
+            # 與 history_arrays_from_frame 相同的規則：先試 YYYY.MM.DD，失敗的再用 mixed
+            raw_dates = chunk['日期'].str.strip()
+            strict = pd.to_datetime(raw_dates, format='%Y.%m.%d', errors='coerce')
+            lenient = pd.to_datetime(raw_dates[strict.isna()], format='mixed', errors='coerce')
+            lenient_dates += int(lenient.notna().sum())
+            bad_dates += int(lenient.isna().sum())
+            chunks.append(chunk)
+            rows += len(chunk)
+            if progress is not None:
+                try: pos = fileobj.tell()
+                except (OSError, ValueError): pos = total_bytes
+                progress(rows, min(pos / total_bytes, 1.0))
+    finally:
+        text.detach()  # 不要讓 TextIOWrapper 關掉上傳的檔案物件
+    if not chunks: raise ValueError("檔案是空的")
+
+    df = pd.concat(chunks, ignore_index=True)
+    atomic_write_csv(df, csv_path)
+    build_history_cache(csv_path, df)
+    seconds = time.perf_counter() - started
+    return {
+        'encoding': encoding, 'rows': rows, 'lenient_dates': lenient_dates, 'bad_dates': bad_dates,
+        'seconds': seconds, 'rows_per_sec': rows / seconds if seconds > 0 else float(rows),
+    }
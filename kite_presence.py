@@ -0,0 +1,159 @@
+# --- 風箏戰情室：選股出現矩陣 (日期 × 策略 × 股票 的位元矩陣) ---
+# 由標準表一次建好 bits[策略, 交易日, 股票] (True = 當天入選)，之後的查詢都是整個矩陣的向量運算：
+#     連續上榜天數 -> 由查詢日往回數連續 True (反向 cumprod 後加總)
+#     多策略共振   -> 區間內各策略有沒有出現 (any) 後，沿策略軸計數 (popcount)
+#     任意區間排行 -> 沿日期軸的前綴和 (cumsum)，區間次數 = 兩個前綴相減，不必重新 groupby
+# 不必每次查詢都重新拆「、」字串。資料庫版本不變就重複使用同一份矩陣。
+# TurnoverPrefix 用同樣的前綴和回答「任意區間的日均成交值」。
+# 本模組不依賴 Streamlit。
+import numpy as np
+import pandas as pd
+
+from kite_sqlite import STRATEGY_LABELS, base_name
+from kite_frame import explode_picks
+
+
+class PresenceMatrix:
+    """
+    bits: bool ndarray，shape = (策略數, 交易日數, 股票數)
+    strategies: 策略欄位名稱 (STRATEGY_LABELS 的 key)
+    dates: 交易日 (DatetimeIndex，舊到新)    stocks: 股票名稱 (去掉 (CB))
+    """
+
+    def __init__(self, bits, strategies, dates, stocks):
+        self.bits = bits
+        self.strategies = list(strategies)
+        self.dates = dates
+        self.stocks = stocks
+        # cum[:, d, :] = 前 d 個交易日的出現次數 (cum[:, 0, :] = 0)
+        self.cum = np.zeros((bits.shape[0], bits.shape[1] + 1, bits.shape[2]), dtype=np.int32)
+        np.cumsum(bits, axis=1, out=self.cum[:, 1:, :])
+
+    @classmethod
+    def from_frame(cls, frame, labels=STRATEGY_LABELS):
+        """標準表 (dt index，由 canonical_frame 產生) -> PresenceMatrix"""
+        strategies = list(labels)
+        dates = pd.DatetimeIndex(frame.index.unique().sort_values()) if not frame.empty else pd.DatetimeIndex([])
+        long = explode_picks(frame, labels)
+        names = long['stock'].str.replace("(CB)", "", regex=False).str.strip()
+        stock_idx, stocks = pd.factorize(names, sort=True)
+        bits = np.zeros((len(strategies), len(dates), len(stocks)), dtype=bool)
+        if len(long):
+            strat_idx = pd.Index(strategies).get_indexer(long['Strategy'])
+            date_idx = dates.get_indexer(long['dt'])
+            bits[strat_idx, date_idx, stock_idx] = True
+        return cls(bits, strategies, dates, pd.Index(stocks, name='stock'))
+
+    def _strategy_rows(self, strategies):
+        if strategies is None: return slice(None)
+        return [self.strategies.index(s) for s in strategies if s in self.strategies]
+
+    def _date_pos(self, as_of):
+        """as_of 當天 (含) 以前最後一個交易日的位置；None = 最新一天"""
+        if as_of is None: return len(self.dates) - 1
+        return int(self.dates.searchsorted(pd.Timestamp(as_of), side='right')) - 1
+
+    def streaks(self, strategies=None, as_of=None):
+        """
+        截至 as_of 為止，每檔股票連續出現在指定策略 (任一) 的交易日數。
+        Returns:
+            Series: index = 股票名稱，只列出連續天數 > 0 的股票 (多到少)
+        """
+        end = self._date_pos(as_of)
+        rows = self._strategy_rows(strategies)
+        if end < 0 or (isinstance(rows, list) and not rows): return pd.Series(dtype=int, name='streak')
+        hit = self.bits[rows, :end + 1, :].any(axis=0)
+        # 由最後一天往回累乘：遇到第一個 False 之後都變 0，加總即連續天數
+        streak = np.cumprod(hit[::-1], axis=0).sum(axis=0)
+        out = pd.Series(streak, index=self.stocks, name='streak')
+        return out[out > 0].sort_values(ascending=False, kind='stable')
+
+    def overlap(self, days=5, as_of=None, min_strategies=1):
+        """
+        最近 days 個交易日 (截至 as_of) 內，每檔股票出現在幾個不同策略。
+        Returns:
+            DataFrame: index = 股票名稱；strategies (策略數)、appearances (出現次數)、各策略是否出現 (bool 欄)
+        """
+        end = self._date_pos(as_of)
+        if end < 0: return pd.DataFrame(columns=['strategies', 'appearances'])
+        window = self.bits[:, max(end - days + 1, 0):end + 1, :]
+        seen = window.any(axis=1)  # (策略, 股票)
+        out = pd.DataFrame(seen.T, index=self.stocks, columns=[STRATEGY_LABELS.get(s, s) for s in self.strategies])
+        out.insert(0, 'appearances', window.sum(axis=(0, 1)))
+        out.insert(0, 'strategies', seen.sum(axis=0))
+        out = out[out['strategies'] >= min_strategies]
+        return out.sort_values(['strategies', 'appearances'], ascending=False, kind='stable')
+
+    def span(self, start=None, end=None, last_n=None):
+        """
+        區間 -> 交易日位置 [i0, i1) (前綴和的兩個端點)
+        last_n: 最近 N 個交易日 (截至 end)；否則用 start ~ end (含)，None 代表不限
+        """
+        i1 = len(self.dates) if end is None else int(self.dates.searchsorted(pd.Timestamp(end), side='right'))
+        if last_n is not None: i0 = max(i1 - last_n, 0)
+        else: i0 = 0 if start is None else int(self.dates.searchsorted(pd.Timestamp(start), side='left'))
+        return i0, max(i0, i1)
+
+    def range_counts(self, start=None, end=None, last_n=None):
+        """區間內各策略、各股票的出現次數 (策略數 × 股票數)；兩個前綴相減，與區間長度無關"""
+        i0, i1 = self.span(start, end, last_n)
+        return self.cum[:, i1, :] - self.cum[:, i0, :]
+
+    def range_leaderboard(self, start=None, end=None, last_n=None):
+        """
+        任意區間的策略排行。
+        Returns:
+            DataFrame: stock, Count, Strategy (顯示名稱)；欄位與 monthly_leaderboard 相同 (少 Month)
+        """
+        counts = self.range_counts(start, end, last_n)
+        strat_idx, stock_idx = np.nonzero(counts)
+        labels = np.array([STRATEGY_LABELS.get(s, s) for s in self.strategies], dtype=object)
+        out = pd.DataFrame({
+            'stock': self.stocks.to_numpy()[stock_idx],
+            'Count': counts[strat_idx, stock_idx].astype(np.int64),
+            'Strategy': labels[strat_idx] if len(labels) else np.array([], dtype=object),
+        })
+        return out.sort_values(['Strategy', 'Count'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+    def window_dates(self, days=5, as_of=None):
+        """overlap 實際涵蓋的 (第一天, 最後一天)"""
+        end = self._date_pos(as_of)
+        if end < 0: return None, None
+        return self.dates[max(end - days + 1, 0)], self.dates[end]
+
+
+class TurnoverPrefix:
+    """
+    每日成交值 (億) 的前綴和。
+    daily: DataFrame，index = 交易日，columns = 股票名稱，沒有資料的日子為 NaN
+    任意區間的日均成交 = (區間成交值總和) / (區間有資料的天數)，都是兩個前綴相減。
+    """
+
+    def __init__(self, daily):
+        daily = daily.sort_index()
+        self.dates = pd.DatetimeIndex(daily.index)
+        self.stocks = pd.Index(daily.columns)
+        values = daily.to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        self.cum_value = np.zeros((len(self.dates) + 1, len(self.stocks)))
+        self.cum_days = np.zeros((len(self.dates) + 1, len(self.stocks)), dtype=np.int32)
+        np.cumsum(np.where(valid, values, 0.0), axis=0, out=self.cum_value[1:])
+        np.cumsum(valid, axis=0, out=self.cum_days[1:])
+
+    def average(self, stock_names, start=None, end=None):
+        """
+        指定區間 (含頭尾) 的日均成交值。
+        Returns:
+            Dict: {'股票名稱': 平均成交值(億)}；名稱可含 (CB)，查無資料為 0.0
+        """
+        i0 = 0 if start is None else int(self.dates.searchsorted(pd.Timestamp(start), side='left'))
+        i1 = len(self.dates) if end is None else int(self.dates.searchsorted(pd.Timestamp(end), side='right'))
+        i1 = max(i0, i1)
+        total = self.cum_value[i1] - self.cum_value[i0]
+        days = self.cum_days[i1] - self.cum_days[i0]
+        avg = np.divide(total, days, out=np.zeros_like(total), where=days > 0)
+        result = {}
+        for name in stock_names:
+            pos = self.stocks.get_indexer([base_name(name)])[0]
+            result[name] = round(float(avg[pos]), 1) if pos >= 0 else 0.0
+        return result
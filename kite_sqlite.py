@@ -0,0 +1,303 @@
+# --- 風箏戰情室：SQLite 索引庫 (daily + appearance 正規化表) ---
+# 每次存檔時，把「、」串起來的策略欄位拆成 (date, strategy, stock) 一列一筆存進 appearance 表，
+# 月度風雲榜 / 個股出現紀錄 / 單日查詢都變成有索引的 SQL 查詢，不必每次 rerun 重新 split + explode。
+# 月度風雲榜另外存成 leaderboard 表 (月份, 策略, 股票, 次數, 族群)：存檔時只重算有變動的月份，
+# 儀表板只讀選定月份那幾十列。
+# meta 表記錄索引同步到資料庫的第幾次寫入 (store_writes)；對不上 (例如上次存檔時索引寫入失敗) 就由資料庫重建。
+# 本模組不依賴 Streamlit。
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import pandas as pd
+
+from kite_store import NUMERIC_COLS, LIST_COLS, month_keys, normalize_records
+
+# 策略欄位 -> 顯示名稱 (與月度風雲榜一致)
+STRATEGY_LABELS = {
+    'worker_strong_list': '🔥 強勢週', 'worker_trend_list': '📈 週趨勢',
+    'boss_pullback_list': '↩️ 週拉回', 'boss_bargain_list': '🏷️ 廉價收購',
+    'top_revenue_list': '💰 營收 TOP6'
+}
+DAILY_TEXT_COLS = ['wind'] + LIST_COLS + ['last_updated', 'manual_turnover']
+DAILY_VALUE_COLS = ['date', 'wind'] + NUMERIC_COLS + LIST_COLS + ['last_updated', 'manual_turnover']  # daily 表扣掉 month
+LEADERBOARD_VERSION = '2'  # leaderboard 表的統計方式；改了之後舊索引檔會整份重算
+SQL_BATCH = 500  # IN (...) 一次最多帶幾個參數 (SQLite 有參數個數上限)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily (
+    date TEXT PRIMARY KEY,
+    month TEXT NOT NULL,
+    wind TEXT,
+    part_time_count INTEGER,
+    worker_strong_count INTEGER,
+    worker_trend_count INTEGER,
+    worker_strong_list TEXT,
+    worker_trend_list TEXT,
+    boss_pullback_list TEXT,
+    boss_bargain_list TEXT,
+    top_revenue_list TEXT,
+    last_updated TEXT,
+    manual_turnover TEXT
+);
+CREATE TABLE IF NOT EXISTS appearance (
+    date TEXT NOT NULL,
+    month TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    stock TEXT NOT NULL,
+    stock_name TEXT NOT NULL,
+    stock_code TEXT,
+    is_cb INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, strategy, position)
+);
+CREATE TABLE IF NOT EXISTS leaderboard (
+    month TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    stock TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    industry TEXT,
+    PRIMARY KEY (month, strategy, stock)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_daily_month ON daily(month);
+CREATE INDEX IF NOT EXISTS idx_appearance_month ON appearance(month, strategy);
+CREATE INDEX IF NOT EXISTS idx_appearance_code ON appearance(stock_code, date);
+CREATE INDEX IF NOT EXISTS idx_appearance_name ON appearance(stock_name, date);
+"""
+
+
+def default_sqlite_path(csv_path):
+    """stock_data_v74.csv -> stock_data_v74.sqlite"""
+    stem, _ = os.path.splitext(csv_path)
+    return f"{stem}.sqlite"
+
+
+def split_stocks(stock_str):
+    """'勤凱(CB)、雍智科技' -> ['勤凱(CB)', '雍智科技']"""
+    if stock_str is None or pd.isna(stock_str): return []
+    return [s.strip() for s in str(stock_str).split('、') if s.strip() and s.strip() != 'nan']
+
+
+def explode_lists(df, id_cols, list_cols=LIST_COLS):
+    """
+    寬表 -> 一檔選股一列：所有策略欄位一次 melt + explode，不逐欄逐列拆字串 (與 split_stocks 的拆法相同)
+    Returns:
+        DataFrame: id_cols..., strategy (欄位名稱), position (同一格內的順序), stock；不修改傳入的資料表
+    """
+    id_cols = list(id_cols)
+    cols = [c for c in list_cols if c in df.columns]
+    if df.empty or not cols: return pd.DataFrame(columns=id_cols + ['strategy', 'position', 'stock'])
+    long = df[id_cols + cols].melt(id_vars=id_cols, value_vars=cols, var_name='strategy', value_name='stock')
+    long['stock'] = long['stock'].astype(str).str.split('、')
+    long = long.explode('stock')  # 保留 melt 後的 index：同一格拆出來的股票 index 相同
+    long['stock'] = long['stock'].str.strip()
+    long = long[long['stock'].notna() & ~long['stock'].isin(['', 'nan'])]
+    long['position'] = long.groupby(level=0).cumcount()
+    return long[id_cols + ['strategy', 'position', 'stock']].reset_index(drop=True)
+
+
+def base_name(stock):
+    """'勤凱(CB)' -> '勤凱'：風雲榜、區間排行、成交值都以去掉 (CB) 的名稱為準"""
+    return str(stock).replace("(CB)", "").strip()
+
+
+class KiteSqliteStore:
+    """
+    resolve: 名稱 -> (code, name, sector) 的查找函式 (e.g. smart_get_code_and_sector)，
+             None 代表不解析代號 (stock_code 留空)。
+    signature: resolve 背後股票主檔的版本；與上次建 leaderboard 時不同 (族群可能變了) 就整份重算
+    """
+
+    def __init__(self, path, resolve=None, signature=None):
+        self.path = path
+        self.resolve = resolve
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # 舊索引檔還沒有 leaderboard、統計方式改過，或主檔換過 (族群可能變了)：由 appearance 表整份重算
+            built = conn.execute("SELECT value FROM meta WHERE key = 'leaderboard_signature'").fetchone()
+            version, _, built_signature = built[0].partition(':') if built else (None, None, None)
+            if version != LEADERBOARD_VERSION or (signature is not None and built_signature != signature):
+                months = [r[0] for r in conn.execute("SELECT DISTINCT month FROM appearance")]
+                conn.execute("DELETE FROM leaderboard")
+                self._refresh_leaderboard(conn, months)
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('leaderboard_signature', ?)",
+                             (f"{LEADERBOARD_VERSION}:{signature or ''}",))
+
+    @contextmanager
+    def _connect(self):
+        # 每次操作各自開關連線 (Streamlit 每個 session 跑在不同 thread)；WAL 讓讀取不會被寫入卡住
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn: yield conn
+        finally:
+            conn.close()
+
+    # --- 寫入 ---
+    def _resolve_column(self, names, field):
+        """
+        名稱欄 -> 代號 (field=0) / 族群 (field=2) 的 list：名稱轉成分類型，每個不同的名稱只查一次，
+        再依分類代碼整欄取回；沒有 resolve 時全部為 None
+        """
+        if self.resolve is None: return [None] * len(names)
+        names = pd.Series(names).astype('category')
+        table = pd.Series([self.resolve(n)[field] for n in names.cat.categories], dtype=object)
+        return table.to_numpy()[names.cat.codes.to_numpy()].tolist()
+
+    def _appearance_rows(self, df):
+        long = explode_lists(df, ['date', '_month'])
+        names = long['stock'].str.replace("(CB)", "", regex=False).str.strip()  # 與 base_name 相同
+        is_cb = long['stock'].str.contains("(CB)", regex=False).astype(int)
+        return zip(long['date'].tolist(), long['_month'].tolist(), long['strategy'].tolist(), long['position'].tolist(),
+                   long['stock'].tolist(), names.tolist(), self._resolve_column(names, 0), is_cb.tolist())
+
+    def _prepare(self, df):
+        # 空資料庫 load_db() 回傳的是沒有欄位的 DataFrame
+        df = normalize_records(df if 'date' in df.columns else df.assign(date=''))
+        for col in NUMERIC_COLS:
+            if col not in df.columns: df[col] = 0
+        for col in DAILY_TEXT_COLS:
+            if col not in df.columns: df[col] = ''
+        df = df.drop_duplicates('date', keep='last')
+        df['_month'] = month_keys(df['date'])
+        return df
+
+    def _write(self, conn, df):
+        daily_cols = ['date', '_month', 'wind'] + NUMERIC_COLS + LIST_COLS + ['last_updated', 'manual_turnover']
+        # tolist() 轉成 Python 原生型別，sqlite3 才能綁定
+        daily_rows = list(zip(*[df[c].tolist() for c in daily_cols]))
+        conn.executemany(f"INSERT OR REPLACE INTO daily VALUES ({','.join('?' * len(daily_cols))})", daily_rows)
+        conn.executemany("DELETE FROM appearance WHERE date = ?", [(d,) for d in df['date']])
+        conn.executemany("INSERT INTO appearance VALUES (?,?,?,?,?,?,?,?)", self._appearance_rows(df))
+        self._refresh_leaderboard(conn, df['_month'].unique().tolist())
+
+    def _refresh_leaderboard(self, conn, months):
+        """
+        只重算指定月份的風雲榜 (存檔時傳入這次有動到的月份)：
+        所有月份一次 GROUP BY，每個不同的股票名稱只查一次族群，再整批寫回。
+        股票以去掉 (CB) 的名稱 (stock_name) 統計、同一天只算一次，與 PresenceMatrix 的區間排行一致。
+        """
+        months = list(months)
+        if not months: return
+        conn.executemany("DELETE FROM leaderboard WHERE month = ?", [(m,) for m in months])
+        frames = []
+        for i in range(0, len(months), SQL_BATCH):
+            batch = months[i:i + SQL_BATCH]
+            frames.append(pd.read_sql_query(
+                f"SELECT month, strategy, stock_name AS stock, COUNT(DISTINCT date) AS count FROM appearance "
+                f"WHERE month IN ({','.join('?' * len(batch))}) GROUP BY month, strategy, stock_name", conn, params=batch))
+        counts = pd.concat(frames, ignore_index=True)
+        if counts.empty: return
+        industry = self._resolve_column(counts['stock'], 2)
+        conn.executemany("INSERT INTO leaderboard VALUES (?,?,?,?,?)", zip(
+            counts['month'].tolist(), counts['strategy'].tolist(), counts['stock'].tolist(), counts['count'].tolist(), industry))
+
+    def upsert_days(self, df, synced=None):
+        """
+        新增/更新指定日期 (save_batch_data)。
+        synced: (寫入前, 寫入後) 的資料庫寫入次數；索引原本停在「寫入前」時，同一個交易內把同步點推進到「寫入後」
+        """
+        df = self._prepare(df)
+        with self._connect() as conn:
+            if not df.empty: self._write(conn, df)
+            if synced is not None:
+                conn.execute("UPDATE meta SET value = ? WHERE key = 'store_writes' AND value = ?",
+                             (str(synced[1]), str(synced[0])))
+
+    def replace_all(self, df, synced=None):
+        """
+        整份同步 (save_full_history / 第一次建立索引)：先跟 daily 表逐日比對，
+        只重寫內容有變的日期、刪掉資料裡已經沒有的日期，風雲榜也只重算這些日期所在的月份。
+        synced: 這份資料對應的資料庫寫入次數
+        """
+        if df.empty or 'date' not in df.columns:
+            # 資料庫是空的 (第一次使用 / clear_db 之後)：索引整個清空，同步點照樣記下
+            self.clear(synced)
+            return
+        df = self._prepare(df)
+        with self._connect() as conn:
+            old = pd.read_sql_query(f"SELECT month, {', '.join(DAILY_VALUE_COLS)} FROM daily", conn).set_index('date')
+            new = df.set_index('date')[DAILY_VALUE_COLS[1:]].astype(str)
+            # 索引裡沒有的日期 reindex 後是 NaN，跟任何字串比都不相等 -> 視為有變
+            changed = df[(new != old[DAILY_VALUE_COLS[1:]].astype(str).reindex(new.index)).any(axis=1).to_numpy()]
+            removed = old[~old.index.isin(new.index)]
+            if not removed.empty:
+                conn.executemany("DELETE FROM daily WHERE date = ?", [(d,) for d in removed.index])
+                conn.executemany("DELETE FROM appearance WHERE date = ?", [(d,) for d in removed.index])
+            if not changed.empty: self._write(conn, changed)
+            # 只有刪除、沒有重寫的月份 (_write 已重算它寫過的月份)
+            self._refresh_leaderboard(conn, sorted(set(removed['month']) - set(changed['_month'])))
+            if synced is None: conn.execute("DELETE FROM meta WHERE key = 'store_writes'")
+            else: conn.execute("INSERT OR REPLACE INTO meta VALUES ('store_writes', ?)", (str(synced),))
+
+    def clear(self, synced=None):
+        """清空索引；synced: 清空後對應的資料庫寫入次數 (None = 不記同步點)"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM appearance")
+            conn.execute("DELETE FROM daily")
+            conn.execute("DELETE FROM leaderboard")
+            if synced is None: conn.execute("DELETE FROM meta WHERE key = 'store_writes'")
+            else: conn.execute("INSERT OR REPLACE INTO meta VALUES ('store_writes', ?)", (str(synced),))
+
+    def synced_writes(self):
+        """索引目前對應到資料庫第幾次寫入 (MonthPartitionedStore.write_count)；從沒同步過時為 None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'store_writes'").fetchone()
+        return int(row[0]) if row else None
+
+    # --- 查詢 ---
+    def day_count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM daily").fetchone()[0]
+
+    def months(self):
+        """有選股紀錄的月份 (新到舊)"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT DISTINCT month FROM appearance ORDER BY month DESC").fetchall()
+        return [r[0] for r in rows]
+
+    def day(self, date):
+        """單日紀錄 (dict)，查無資料回傳 None"""
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM daily WHERE date = ?", (date,)).fetchone()
+        return dict(row) if row else None
+
+    def appearances_on(self, date):
+        """單日所有策略選股 (date, strategy, stock, stock_name, stock_code, is_cb)"""
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                "SELECT date, strategy, stock, stock_name, stock_code, is_cb FROM appearance "
+                "WHERE date = ? ORDER BY strategy, position", conn, params=(date,))
+
+    def monthly_leaderboard(self, month):
+        """
+        指定月份各策略的出現次數與族群 (讀預先算好的 leaderboard 表)。
+        Returns:
+            DataFrame: Month, stock, Count, Strategy, Industry
+        """
+        with self._connect() as conn:
+            df = pd.read_sql_query(
+                "SELECT month AS Month, stock, count AS Count, strategy AS Strategy, industry AS Industry "
+                "FROM leaderboard WHERE month = ? ORDER BY count DESC, stock", conn, params=(month,))
+        if df.empty: return df
+        df['Strategy'] = df['Strategy'].map(STRATEGY_LABELS)
+        return df.sort_values(['Strategy', 'Count'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+    def stock_history(self, stock):
+        """個股出現紀錄：可用代號或名稱查詢 (新到舊)"""
+        key = base_name(stock)
+        code = key if key.isdigit() else None
+        if code is None and self.resolve is not None:
+            code, key, _ = self.resolve(key)
+        with self._connect() as conn:
+            df = pd.read_sql_query(
+                "SELECT date, strategy, stock, is_cb FROM appearance "
+                "WHERE stock_name = ? OR (stock_code IS NOT NULL AND stock_code = ?) "
+                "ORDER BY date DESC, strategy", conn, params=(key, code))
+        df['strategy'] = df['strategy'].map(STRATEGY_LABELS)
+        return df
@@ -0,0 +1,421 @@
+# --- 風箏戰情室：欄式分月資料庫 (Columnar, month-partitioned record store) ---
+# 每個月份一個 Parquet 檔 (month=YYYY-MM/data.parquet)，欄位型別在寫入時就固定好，
+# 讀取時可以只挑需要的欄位與月份，不必每次 rerun 都把整份 CSV 重新解析一遍。
+# 新增/更新的日期先附加到更新紀錄 (只寫新資料)，累積到一定筆數再整併回分月檔。
+# 所有資料檔寫入後就不再修改；寫入端先寫新檔 + fsync，再以原子 rename 換上新版 _manifest.json，
+# 讀取端只看 manifest 指到的檔案，不需要上鎖，也永遠不會讀到寫一半的資料。
+# 本模組不依賴 Streamlit，app_v71.py / app_v72.py 共用。
+import os
+import json
+import time
+import shutil
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# 欄位定義 (與 stock_data_v7x.csv 相同)
+NUMERIC_COLS = ['part_time_count', 'worker_strong_count', 'worker_trend_count']
+LIST_COLS = ['worker_strong_list', 'worker_trend_list', 'boss_pullback_list', 'boss_bargain_list', 'top_revenue_list']
+TEXT_COLS = ['date', 'wind'] + LIST_COLS + ['last_updated', 'manual_turnover']
+BASE_COLUMNS = ['date', 'wind'] + NUMERIC_COLS + LIST_COLS + ['last_updated', 'manual_turnover']
+
+UNKNOWN_MONTH = 'unknown'  # 日期無法解析的資料放這一區
+PARTITION_FILE = 'data.parquet'  # 舊版 (無 manifest) 的分區檔名
+LOG_FILE = '_upsert_log.jsonl'    # 舊版 (無 manifest) 的更新紀錄檔名
+MANIFEST_FILE = '_manifest.json'
+COMPACT_THRESHOLD = 200  # 更新紀錄超過這個筆數就在背景整併
+GC_GRACE_SECONDS = 120   # 舊版本檔案「被換下來之後」保留多久才刪 (讓還在讀舊 manifest 的 session 讀完)
+
+# 同一個 process 內的寫入 (附加紀錄 / 整併 / 整份覆蓋) 互斥
+_WRITE_LOCK = threading.RLock()
+
+
+def default_store_dir(csv_path):
+    """stock_data_v74.csv -> stock_data_v74_store"""
+    stem, _ = os.path.splitext(csv_path)
+    return f"{stem}_store"
+
+
+def file_fingerprint(path):
+    """(path, mtime_ns, size)；檔案不存在時為 (path, None, None)。用來當快取的 key"""
+    try:
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return (path, None, None)
+
+
+def _fsync_dir(dir_path):
+    # Windows 不支援對目錄 fsync，略過即可
+    try:
+        fd = os.open(dir_path or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try: os.fsync(fd)
+    except OSError: pass
+    finally: os.close(fd)
+
+
+def atomic_write_bytes(path, data):
+    """先寫暫存檔並 fsync，再原子 rename 蓋過目標檔：讀取端只會看到舊檔或完整的新檔"""
+    dir_path = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dir_path, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+    _fsync_dir(dir_path)
+
+
+def atomic_write_csv(df, path, encoding='utf-8-sig'):
+    atomic_write_bytes(path, df.to_csv(index=False).encode(encoding))
+
+
+def month_keys(date_series):
+    """把 date 欄位轉成分區用的 'YYYY-MM' 字串 (相容 '2025 12-04' 這類舊格式)"""
+    dt = pd.to_datetime(date_series.astype(str), format='mixed', errors='coerce')
+    return dt.dt.strftime('%Y-%m').fillna(UNKNOWN_MONTH)
+
+
+def normalize_records(df):
+    """統一欄位型別：數字欄位 -> int32，其餘文字欄位 -> str (空值為 '')"""
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+    for col in NUMERIC_COLS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('int32')
+    for col in df.columns:
+        if col in NUMERIC_COLS: continue
+        df[col] = df[col].astype(object).where(df[col].notna(), '').astype(str).replace('nan', '')
+    if 'date' in df.columns:
+        df['date'] = df['date'].str.strip()
+        df = df[df['date'] != '']
+    return df.reset_index(drop=True)
+
+
+def merge_upserts(base_df, updates_df):
+    """以 date 為 key，updates 覆蓋 base (同一天多筆時以最後一筆為準)"""
+    updates_df = updates_df.drop_duplicates('date', keep='last')
+    if base_df.empty: return updates_df.reset_index(drop=True)
+    base_df = base_df[~base_df['date'].isin(updates_df['date'])]
+    return pd.concat([base_df, updates_df], ignore_index=True)
+
+
+def _arrow_schema(columns):
+    fields = []
+    for col in columns:
+        if col in NUMERIC_COLS: fields.append(pa.field(col, pa.int32()))
+        else: fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+
+class MonthPartitionedStore:
+    """
+    分月 Parquet 資料庫 + 附加式更新紀錄 + 版本化 manifest。
+    root/
+        _manifest.json                  <- 目前版本指到哪些檔案 (原子替換)
+        month=2025-11/v000003.parquet   <- 分區檔，寫入後不再修改
+        month=2025-12/v000005.parquet
+        _upsert_log.v000005.jsonl       <- 尚未整併的新增/更新 (一行一筆，只會附加)
+    讀取時自動把更新紀錄疊加在分月檔上，呼叫端看到的永遠是合併後的結果。
+    """
+
+    def __init__(self, root, compact_threshold=COMPACT_THRESHOLD):
+        self.root = root
+        self.compact_threshold = compact_threshold
+
+    # --- manifest ---
+    def _manifest_path(self):
+        return os.path.join(self.root, MANIFEST_FILE)
+
+    def read_manifest(self):
+        """
+        目前版本的 manifest：{'version', 'partitions': {month: 相對路徑}, 'log': 相對路徑}
+        舊版目錄 (month=X/data.parquet + _upsert_log.jsonl) 沒有 manifest，直接沿用舊檔。
+        """
+        try:
+            with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        partitions = {}
+        if os.path.isdir(self.root):
+            for entry in os.listdir(self.root):
+                if entry.startswith('month=') and os.path.exists(os.path.join(self.root, entry, PARTITION_FILE)):
+                    partitions[entry[len('month='):]] = f"{entry}/{PARTITION_FILE}"
+        return {'version': 0, 'partitions': partitions, 'log': LOG_FILE}
+
+    def _publish(self, manifest, partitions, log_name=None, writes=None):
+        """
+        寫出新版本 manifest (原子替換)，之後清掉過期的舊版本檔案。
+        writes: 到這個版本為止的累計寫入次數 (見 write_count)；None 代表沿用舊版本的值
+        """
+        version = manifest['version'] + 1
+        log_rel = log_name or f"_upsert_log.v{version:06d}.jsonl"
+        live = set(partitions.values()) | {log_rel}
+        # 被這一版換下來的檔案記下退役時間；保留期限從這時候起算 (不是檔案的 mtime)
+        now = time.time()
+        retired = {rel: t for rel, t in manifest.get('retired', {}).items() if rel not in live}
+        for rel in list(manifest['partitions'].values()) + [manifest['log']]:
+            if rel not in live: retired.setdefault(rel, now)
+        expired = [rel for rel, t in retired.items() if t < now - GC_GRACE_SECONDS]
+        for rel in expired: del retired[rel]
+        new_manifest = {
+            'version': version,
+            'partitions': dict(sorted(partitions.items())),
+            'log': log_rel,
+            'writes': manifest.get('writes', 0) if writes is None else writes,
+            'retired': retired,
+            'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        atomic_write_bytes(self._manifest_path(), json.dumps(new_manifest, ensure_ascii=False, indent=1).encode('utf-8'))
+        self._collect_garbage(new_manifest, expired)
+        return new_manifest
+
+    def _collect_garbage(self, manifest, expired):
+        """
+        刪掉退役超過保留期限的檔案 (expired)。
+        manifest 從沒提過的檔案 (寫到一半就中斷的分區、暫存檔) 沒有退役時間，才退回用 mtime 判斷。
+        """
+        for rel in expired:
+            try: os.remove(self._abs(rel))
+            except OSError: pass
+        known = set(manifest['partitions'].values()) | {manifest['log'], MANIFEST_FILE} | set(manifest['retired'])
+        cutoff = time.time() - GC_GRACE_SECONDS
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            for name in file_names:
+                full = os.path.join(dir_path, name)
+                rel = os.path.relpath(full, self.root).replace(os.sep, '/')
+                if rel in known: continue
+                try:
+                    if os.path.getmtime(full) < cutoff: os.remove(full)
+                except OSError: pass
+            if dir_path != self.root and not file_names and not dir_names:
+                try: os.rmdir(dir_path)
+                except OSError: pass
+
+    # --- 路徑 ---
+    def _partition_dir(self, month):
+        return os.path.join(self.root, f"month={month}")
+
+    def _abs(self, rel_path):
+        return os.path.join(self.root, rel_path)
+
+    def _log_path(self, manifest=None):
+        return self._abs((manifest or self.read_manifest())['log'])
+
+    def exists(self):
+        manifest = self.read_manifest()
+        return len(manifest['partitions']) > 0 or os.path.exists(self._log_path(manifest))
+
+    def fingerprint(self):
+        """manifest + 更新紀錄的 (path, mtime, size)；任何寫入都會讓它改變"""
+        manifest = self.read_manifest()
+        return (manifest['version'], file_fingerprint(self._manifest_path()), file_fingerprint(self._log_path(manifest)))
+
+    def write_count(self):
+        """
+        累計寫入次數：manifest 記錄的次數 + 更新紀錄的筆數。
+        附加紀錄時 +筆數、整份覆蓋時 +1；整併只是搬位置，次數不變 (索引庫用它判斷是否跟上資料庫)。
+        """
+        manifest = self.read_manifest()
+        return manifest.get('writes', 0) + self.log_size(manifest)
+
+    def partition_months(self, manifest=None):
+        """已整併進分月檔的月份 (新到舊)"""
+        return sorted((manifest or self.read_manifest())['partitions'].keys(), reverse=True)
+
+    def months(self):
+        """所有有資料的月份 (含尚未整併的更新紀錄，新到舊)"""
+        def collect(manifest):
+            found = set(manifest['partitions'].keys())
+            log_df = self.read_log(manifest)
+            if not log_df.empty: found.update(month_keys(log_df['date']))
+            return sorted(found, reverse=True)
+        return self._on_current_manifest(collect)
+
+    def _on_current_manifest(self, fn):
+        """
+        用目前的 manifest 執行 fn(manifest)。檔案只會在退役超過保留期限後才被清掉；
+        萬一手上的 manifest 舊到檔案已經不見 (FileNotFoundError)，換新的 manifest 重來。
+        """
+        for attempt in range(3):
+            try: return fn(self.read_manifest())
+            except FileNotFoundError:
+                if attempt == 2: raise
+
+    # --- 更新紀錄 (append-only log) ---
+    def read_log(self, manifest=None):
+        """
+        讀取尚未整併的更新紀錄 (依寫入順序)；正在寫入、還不完整的最後一行會略過。
+        Raises:
+            FileNotFoundError: manifest 指到的紀錄檔已被清掉 (手上的 manifest 太舊，換新的重讀)
+        """
+        manifest = manifest or self.read_manifest()
+        path = self._log_path(manifest)
+        if not os.path.exists(path):
+            # 還是目前版本：只是還沒有任何紀錄；已經被換掉：紀錄檔可能退役後被清掉了，不能當成空的
+            if self.read_manifest()['version'] == manifest['version']: return pd.DataFrame()
+            raise FileNotFoundError(path)
+        records = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith("\n"): break
+                line = line.strip()
+                if not line: continue
+                try: records.append(json.loads(line))
+                except ValueError: continue
+        if not records: return pd.DataFrame()
+        return normalize_records(pd.DataFrame(records))
+
+    def log_size(self, manifest=None):
+        path = self._log_path(manifest)
+        if not os.path.exists(path): return 0
+        with open(path, 'rb') as f:
+            return sum(1 for line in f if line.strip())
+
+    def _append_log(self, df):
+        lines = [json.dumps(rec, ensure_ascii=False, default=int) for rec in df.to_dict('records')]
+        with _WRITE_LOCK:
+            manifest = self.read_manifest()
+            if not os.path.exists(self._manifest_path()):
+                manifest = self._publish(manifest, manifest['partitions'], log_name=manifest['log'])
+            with open(self._log_path(manifest), 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    # --- 讀取 ---
+    def _read_partition(self, manifest, month, columns=None):
+        path = self._abs(manifest['partitions'][month])
+        if columns is not None:
+            available = pq.read_schema(path).names
+            columns = [c for c in columns if c in available]
+        return pq.read_table(path, columns=columns).to_pandas()
+
+    def read(self, columns=None, months=None, include_log=True):
+        """
+        讀取資料 (可指定欄位與月份)。
+        Args:
+            columns: 欄位清單，None 代表全部 ('date' 一定會帶上)
+            months: 月份清單 (e.g. ['2025-12'])，None 代表全部
+            include_log: 是否疊加尚未整併的更新紀錄
+        """
+        return self._on_current_manifest(lambda manifest: self._read_version(manifest, columns, months, include_log))
+
+    def _read_version(self, manifest, columns, months, include_log):
+        if columns is not None and 'date' not in columns:
+            columns = ['date'] + list(columns)
+        month_set = None if months is None else set(months)
+        wanted = [m for m in self.partition_months(manifest) if month_set is None or m in month_set]
+        frames = [self._read_partition(manifest, m, columns) for m in wanted]
+        frames = [f for f in frames if not f.empty]
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns or [])
+
+        if include_log:
+            log_df = self.read_log(manifest)
+            if not log_df.empty:
+                if month_set is not None:
+                    log_df = log_df[month_keys(log_df['date']).isin(month_set)]
+                if columns is not None:
+                    log_df = log_df[[c for c in columns if c in log_df.columns]]
+                if not log_df.empty:
+                    df = merge_upserts(df, log_df)
+
+        if df.empty: return pd.DataFrame(columns=columns or [])
+        return df.sort_values('date', ascending=False).reset_index(drop=True)
+
+    # --- 寫入 (一律寫新檔，最後換 manifest) ---
+    def _write_partition(self, version, month, part_df):
+        """寫出新版本分區檔並 fsync，回傳相對路徑"""
+        part_df = part_df.sort_values('date', ascending=False).reset_index(drop=True)
+        table = pa.Table.from_pandas(part_df, schema=_arrow_schema(part_df.columns), preserve_index=False)
+        rel_path = f"month={month}/v{version:06d}.parquet"
+        buf = pa.BufferOutputStream()
+        pq.write_table(table, buf, compression='zstd')
+        atomic_write_bytes(self._abs(rel_path), buf.getvalue().to_pybytes())
+        return rel_path
+
+    def write_all(self, df):
+        """整份覆蓋 (歷史資料庫編輯器存檔用)，同時換一個新的空白更新紀錄"""
+        df = normalize_records(df)
+        keys = month_keys(df['date']) if not df.empty else pd.Series(dtype=str)
+        with _WRITE_LOCK:
+            manifest = self.read_manifest()
+            version = manifest['version'] + 1
+            partitions = {}
+            for month, part in df.groupby(keys, sort=False):
+                partitions[month] = self._write_partition(version, month, part)
+            self._publish(manifest, partitions, writes=manifest.get('writes', 0) + self.log_size(manifest) + 1)
+
+    def upsert(self, new_df):
+        """
+        以 date 為 key 新增/更新：只把新資料附加到更新紀錄，成本與新資料筆數成正比。
+        紀錄累積超過 compact_threshold 筆時在背景整併。回傳受影響的月份。
+        """
+        new_df = normalize_records(new_df)
+        if new_df.empty: return []
+        new_df = new_df.drop_duplicates('date', keep='last')
+        self._append_log(new_df)
+        if self.compact_threshold and self.log_size() >= self.compact_threshold:
+            threading.Thread(target=self.compact, daemon=True).start()
+        return sorted(month_keys(new_df['date']).unique(), reverse=True)
+
+    def compact(self):
+        """把更新紀錄整併回分月檔 (只重寫有更新的月份)，回傳整併的月份"""
+        with _WRITE_LOCK:
+            manifest = self.read_manifest()
+            log_df = self.read_log(manifest)
+            if log_df.empty: return []
+            folded = self.log_size(manifest)
+            version = manifest['version'] + 1
+            partitions = dict(manifest['partitions'])
+            touched = []
+            for month, part in log_df.groupby(month_keys(log_df['date']), sort=False):
+                base = self._read_partition(manifest, month) if month in partitions else pd.DataFrame()
+                merged = normalize_records(merge_upserts(base, part))
+                if merged.empty: partitions.pop(month, None)
+                else: partitions[month] = self._write_partition(version, month, merged)
+                touched.append(month)
+            self._publish(manifest, partitions, writes=manifest.get('writes', 0) + folded)
+            return sorted(touched, reverse=True)
+
+    def clear(self):
+        with _WRITE_LOCK:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+def read_legacy_csv(csv_path):
+    return pd.read_csv(csv_path, encoding='utf-8-sig', dtype=str, keep_default_na=False)
+
+
+def migrate_csv_to_store(csv_path, store_dir=None, overwrite=False):
+    """
+    一次性搬移：把舊的單一 CSV (stock_data_v74.csv / stock_data_v72.csv) 轉成分月 Parquet。
+    原 CSV 保留不動，之後讀寫都走 store。
+    """
+    store = MonthPartitionedStore(store_dir or default_store_dir(csv_path))
+    if store.exists() and not overwrite: return store
+    df = read_legacy_csv(csv_path)
+    if 'date' not in df.columns: raise ValueError(f"{csv_path} 缺少 date 欄位")
+    store.write_all(df)
+    return store
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="把 stock_data_v7x.csv 轉成分月 Parquet 資料庫")
+    parser.add_argument("csv_path")
+    parser.add_argument("--store-dir", default=None)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+    migrated = migrate_csv_to_store(args.csv_path, args.store_dir, overwrite=args.overwrite)
+    print(f"✅ 已轉換 {args.csv_path} -> {migrated.root} ({len(migrated.months())} 個月份)")
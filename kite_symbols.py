@@ -0,0 +1,316 @@
+# --- 風箏戰情室：股票名稱 / 代號查找 (Symbol resolver) ---
+# 原本 smart_get_code_and_sector 每次呼叫都要做字串清理 + 好幾次 dict 查找，
+# 又常被 .apply / iterrows / 逐個標籤呼叫。這裡把查找表在建立時一次算好，其他查詢結果記在有上限的 LRU，
+# 整欄查詢 (resolve_many) 先去重再查，回傳與輸入對齊的 code / name / sector 陣列。
+# 主檔 (MASTER_STOCK_DB / ALIAS_MAP / FORCE_FIX_SECTOR) 沒變就沿用同一個 resolver。
+# 全市場主檔 stock_master.csv (code, name, market, sector, aliases) 由證交所 ISIN 頁面產生，
+# 記錄每檔股票是上市 (.TW) 還是上櫃 (.TWO)，抓報價時每檔只需要要一個 ticker。
+# 本模組不依賴 Streamlit。
+import io
+import os
+import json
+import hashlib
+import argparse
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from kite_store import atomic_write_csv
+
+DEFAULT_SECTOR = "其他"
+MASTER_FILE = 'stock_master.csv'
+MASTER_COLUMNS = ['code', 'name', 'market', 'sector', 'aliases']
+ALIAS_SEP = '|'
+# 證交所 ISIN 公開資料：2 = 上市、4 = 上櫃、5 = 興櫃
+ISIN_URLS = {
+    '上市': 'https://isin.twse.com.tw/isin/C_public.jsp?strMode=2',
+    '上櫃': 'https://isin.twse.com.tw/isin/C_public.jsp?strMode=4',
+    '興櫃': 'https://isin.twse.com.tw/isin/C_public.jsp?strMode=5',
+}
+MARKET_SUFFIX = {'上市': '.TW', '上櫃': '.TWO', '興櫃': '.TWO'}
+ISIN_SECTIONS = ('股票', '臺灣存託憑證')  # 只收普通股與 TDR (略過 ETF、權證、債券...)
+FUZZY_MIN_SCORE = 0.75   # 模糊比對信心分數低於這個就當作查無此股
+FUZZY_CANDIDATES = 20    # n-gram 初篩後，只對重疊最多的前幾名算編輯距離
+PREFIX_SCORE = 0.8       # 唯一前綴相符 (名稱被截斷) 的信心分數
+MEMO_SIZE = 4096         # 主檔以外的查詢 (OCR 名稱、使用者輸入...) 最多記住幾筆 (LRU)
+
+
+# --- 全市場主檔 ---
+def _auto_aliases(name):
+    """'世芯-KY' -> ['世芯']；OCR 常把 -KY / -DR 後綴吃掉"""
+    aliases = []
+    for suffix in ('-KY', '-DR'):
+        if name.endswith(suffix) and len(name) > len(suffix): aliases.append(name[:-len(suffix)])
+    return aliases
+
+
+def parse_isin_page(html, market):
+    """ISIN 頁面 HTML -> DataFrame(code, name, market, sector, aliases)"""
+    table = pd.read_html(io.StringIO(html), header=0)[0].astype(str)
+    # 第一欄 '有價證券代號及名稱' e.g. '2330　台積電'；產業別欄位名稱含 '產業'
+    sector_idx = next((i for i, c in enumerate(table.columns) if '產業' in str(c)), None)
+    rows, section = [], None
+    for values in table.itertuples(index=False):
+        head = values[0].strip()
+        # 分類標題列 (e.g. '股票') 整列都是同一個字串
+        if all(v.strip() == head for v in values):
+            section = head
+            continue
+        if section is None or not section.startswith(ISIN_SECTIONS): continue
+        parts = head.replace('\u3000', ' ').split(None, 1)
+        if len(parts) != 2: continue
+        code, name = parts[0].strip(), parts[1].strip()
+        sector = values[sector_idx].strip() if sector_idx is not None else ''
+        if sector in ('', 'nan'): sector = DEFAULT_SECTOR
+        rows.append({'code': code, 'name': name, 'market': market, 'sector': sector,
+                     'aliases': ALIAS_SEP.join(_auto_aliases(name))})
+    return pd.DataFrame(rows, columns=MASTER_COLUMNS)
+
+
+def fetch_isin_master(markets=('上市', '上櫃'), timeout=30):
+    """從證交所 ISIN 頁面抓全市場股票清單 (需要網路)"""
+    import requests
+    frames = []
+    for market in markets:
+        r = requests.get(ISIN_URLS[market], timeout=timeout, headers={'User-Agent': 'Mozilla/5.0'})
+        r.raise_for_status()
+        r.encoding = 'cp950'  # 頁面是 MS950 (Big5)
+        frames.append(parse_isin_page(r.text, market))
+    df = pd.concat(frames, ignore_index=True)
+    return df.drop_duplicates('code', keep='first').sort_values('code').reset_index(drop=True)
+
+
+def save_master_file(df, path=MASTER_FILE):
+    atomic_write_csv(df[MASTER_COLUMNS], path)
+
+
+def load_master_file(path=MASTER_FILE):
+    """
+    讀全市場主檔。
+    Returns:
+        (master {code: (name, sector)}, markets {code: market}, aliases {別名: 名稱})；檔案不存在時都是空 dict
+    """
+    if not os.path.exists(path): return {}, {}, {}
+    df = pd.read_csv(path, encoding='utf-8-sig', dtype=str, keep_default_na=False)
+    master, markets, aliases = {}, {}, {}
+    for code, name, market, sector, alias_str in df[MASTER_COLUMNS].itertuples(index=False):
+        code, name = code.strip(), name.strip()
+        if not code or not name: continue
+        master[code] = (name, sector.strip() or DEFAULT_SECTOR)
+        if market.strip(): markets[code] = market.strip()
+        for alias in alias_str.split(ALIAS_SEP):
+            if alias.strip() and alias.strip() != name: aliases.setdefault(alias.strip(), name)
+    return master, markets, aliases
+
+
+# --- 模糊比對 (OCR 名稱多了空白、*、全形字、錯一個字...) ---
+def normalize_name(name):
+    """全形轉半形、去空白 / * / (CB)、英文轉大寫"""
+    s = unicodedata.normalize('NFKC', str(name)).replace("(CB)", "").replace("*", "")
+    return "".join(s.split()).upper()
+
+
+def _grams(key):
+    padded = f"^{key}$"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def edit_distance(a, b):
+    if a == b: return 0
+    if len(a) < len(b): a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+class FuzzyNameIndex:
+    """
+    名稱 / 別名的 bigram 倒排索引 (建一次)：
+    查詢時先用 bigram 重疊數挑出少數候選，再算編輯距離，信心分數 = 1 - 距離 / 較長字串長度。
+    """
+
+    def __init__(self, names):
+        """names: {可比對的名稱或別名: 正式名稱}"""
+        self.keys, self.targets, self.exact = [], [], {}
+        self.postings = {}
+        for name, target in names.items():
+            key = normalize_name(name)
+            if not key or key in self.exact: continue
+            idx = len(self.keys)
+            self.keys.append(key)
+            self.targets.append(target)
+            self.exact[key] = idx
+            for gram in _grams(key):
+                self.postings.setdefault(gram, []).append(idx)
+
+    def match(self, name, min_score=0.0):
+        """回傳 (正式名稱, 信心分數 0~1)；低於 min_score 時回傳 (None, 分數)"""
+        key = normalize_name(name)
+        if not key: return None, 0.0
+        if key in self.exact: return self.targets[self.exact[key]], 1.0
+        overlap = Counter()
+        for gram in _grams(key):
+            overlap.update(self.postings.get(gram, ()))
+        best, best_score = None, 0.0
+        prefixed = []
+        for idx, _ in overlap.most_common(FUZZY_CANDIDATES):
+            cand = self.keys[idx]
+            if len(key) >= 2 and cand.startswith(key): prefixed.append(idx)
+            score = 1 - edit_distance(key, cand) / max(len(key), len(cand))
+            if score > best_score: best, best_score = idx, score
+        # 名稱被截斷 (e.g. '宏碩' -> '宏碩系統')：以它開頭的候選都指向同一檔股票時才採用
+        if len({self.targets[i] for i in prefixed}) == 1 and best_score < PREFIX_SCORE: best, best_score = prefixed[0], PREFIX_SCORE
+        if best is None or best_score < min_score: return None, best_score
+        return self.targets[best], best_score
+
+
+def master_signature(*tables):
+    """主檔內容的雜湊：內容沒變 -> 簽章相同 -> 不必重建 resolver"""
+    data = json.dumps(tables, ensure_ascii=False, sort_keys=True, default=list)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class SymbolResolver:
+    """
+    master: {code: (name, sector)}
+    aliases: {別名: 正式名稱}
+    force_sector: {名稱: 族群} (優先於主檔的族群)
+    markets: {code: '上市' / '上櫃' / '興櫃'} (決定 Yahoo ticker 後綴)
+    complete: master 是否為全市場主檔。只有手動維護的幾十檔時，很多真實存在的股票不在表上
+              (e.g. '南亞' 會被前綴規則對到 '南亞科')，所以只接受正規化後完全相同的名稱 (全形、空白、*)，
+              不做模糊 / 前綴比對
+    """
+
+    def __init__(self, master, aliases=None, force_sector=None, markets=None, complete=False):
+        self.master = dict(master)
+        self.aliases = dict(aliases or {})
+        self.force_sector = dict(force_sector or {})
+        self.markets = dict(markets or {})
+        self.name_to_code = {name: code for code, (name, _) in self.master.items()}
+        self.signature = master_signature(self.master, self.aliases, self.force_sector, self.markets)
+        known = {name: name for name in self.name_to_code}
+        known.update({name: name for name in self.force_sector})
+        known.update(self.aliases)
+        self.complete = complete
+        self.fuzzy = FuzzyNameIndex(known)
+        # 所有已知名稱 / 代號 / 別名的結果預先算好 (大小固定 = 主檔大小)；
+        # 其他查詢 (OCR 名稱、個股查詢的自由輸入) 走有上限的 LRU，process 跑再久也不會一直長大
+        self._known = {}
+        for key in list(self.name_to_code) + list(self.master) + list(self.aliases) + list(self.force_sector):
+            key = str(key).strip()
+            self._known[key] = self._lookup(key)
+        self._lookup_other = lru_cache(maxsize=MEMO_SIZE)(self._lookup)
+
+    def _lookup(self, raw):
+        clean = raw.replace("(CB)", "").strip()
+        if clean in self.aliases: clean = self.aliases[clean]
+        clean_no_star = clean.replace("*", "")
+
+        code = None
+        if clean in self.name_to_code: code = self.name_to_code[clean]
+        elif clean_no_star in self.name_to_code: code = self.name_to_code[clean_no_star]
+        elif clean.isdigit() and clean in self.master: code = clean
+        elif not clean.isdigit() and clean not in self.force_sector:
+            # 查不到時用模糊比對 (e.g. OCR 多了空白、全形字、錯一個字)
+            match, _ = self._match(clean, FUZZY_MIN_SCORE)
+            if match is not None and match != clean: return self._lookup(match)
+
+        sector = DEFAULT_SECTOR
+        if clean in self.force_sector: sector = self.force_sector[clean]
+        elif code and code in self.master: sector = self.master[code][1]
+
+        name = clean
+        if code and code in self.master: name = self.master[code][0]
+        return code, name, sector
+
+    def _match(self, clean, min_score):
+        """模糊比對；沒有全市場主檔時只接受信心 1.0 (正規化後完全相同) 的結果"""
+        return self.fuzzy.match(clean, min_score if self.complete else 1.0)
+
+    def resolve(self, stock_input):
+        """名稱 / 代號 (可含 (CB)、*、空白) -> (code, name, sector)；查不到時 code 為 None"""
+        raw = str(stock_input).strip()
+        hit = self._known.get(raw)
+        return hit if hit is not None else self._lookup_other(raw)
+
+    def resolve_many(self, names):
+        """
+        整欄查詢：先去重，每個不同的名稱只查一次。
+        Returns:
+            (codes, names, sectors)：與輸入等長的 object ndarray
+        """
+        values = pd.Series(names, dtype=object).fillna('').astype(str)
+        if values.empty:
+            empty = np.array([], dtype=object)
+            return empty, empty.copy(), empty.copy()
+        labels, uniques = pd.factorize(values)
+        resolved = [self.resolve(u) for u in uniques]
+        codes = np.array([r[0] for r in resolved], dtype=object)[labels]
+        clean_names = np.array([r[1] for r in resolved], dtype=object)[labels]
+        sectors = np.array([r[2] for r in resolved], dtype=object)[labels]
+        return codes, clean_names, sectors
+
+    def suggest_name(self, stock, min_score=FUZZY_MIN_SCORE):
+        """
+        匯入時替 OCR 名稱找建議的正式名稱 (保留 (CB) 標記)：'台 積電*' -> '台積電'
+        只是建議，要不要採用由管理員確認；沒有全市場主檔時只建議正規化後完全相同的名稱。
+        Returns:
+            (建議名稱, 信心分數)；已是正式名稱或信心不足時建議名稱為 None
+        """
+        raw = str(stock).strip()
+        is_cb = "(CB)" in raw
+        clean = raw.replace("(CB)", "").strip()
+        if clean in self.name_to_code or clean in self.force_sector: return None, 1.0
+        match, score = self._match(clean, min_score)
+        if match is None or match == clean: return None, score
+        return (f"{match}(CB)" if is_cb else match), score
+
+    def market(self, code):
+        return self.markets.get(str(code))
+
+    def tickers(self, code):
+        """
+        抓報價用的 Yahoo ticker：主檔知道上市 / 上櫃時只回傳一個；
+        不在主檔裡的代號才退回兩個後綴都試。
+        """
+        suffix = MARKET_SUFFIX.get(self.markets.get(str(code)))
+        if suffix: return [f"{code}{suffix}"]
+        return [f"{code}.TW", f"{code}.TWO"]
+
+
+def build_resolver(master, aliases=None, force_sector=None, master_path=MASTER_FILE):
+    """
+    手動主檔 (MASTER_STOCK_DB 等) 疊在全市場主檔 (stock_master.csv) 上：
+    同一代號以手動主檔的名稱 / 族群為準，全市場主檔的正式名稱自動變成別名。
+    """
+    file_master, markets, file_aliases = load_master_file(master_path)
+    merged = dict(file_master)
+    merged_aliases = {}
+    for code, (name, sector) in master.items():
+        if code in file_master and file_master[code][0] != name:
+            merged_aliases[file_master[code][0]] = name
+        merged[code] = (name, sector)
+    real_names = {name for name, _ in merged.values()}
+    for alias, name in file_aliases.items():
+        # 自動產生的別名不能蓋掉另一檔股票的正式名稱
+        if alias not in real_names: merged_aliases.setdefault(alias, name)
+    merged_aliases.update(aliases or {})
+    return SymbolResolver(merged, merged_aliases, force_sector, markets, complete=bool(file_master))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="從證交所 ISIN 頁面更新全市場股票主檔")
+    parser.add_argument("--output", default=MASTER_FILE)
+    parser.add_argument("--emerging", action="store_true", help="一併收錄興櫃股票")
+    args = parser.parse_args()
+    markets = ('上市', '上櫃', '興櫃') if args.emerging else ('上市', '上櫃')
+    df = fetch_isin_master(markets)
+    save_master_file(df, args.output)
+    print(f"已寫入 {args.output}：{len(df)} 檔 ({', '.join(f'{m} {n}' for m, n in df['market'].value_counts().items())})")
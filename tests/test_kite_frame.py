@@ -0,0 +1,23 @@
+import pandas as pd
+
+from kite_frame import canonical_frame, build_day_views
+
+
+def test_day_views_merge_rows_that_normalize_to_the_same_day():
+    raw = pd.DataFrame([
+        {'date': '2024/1/5', 'wind': '強風', 'part_time_count': 3, 'worker_strong_list': '台積電、鴻海'},
+        {'date': '2024-01-05', 'wind': '', 'part_time_count': 5, 'worker_strong_list': '鴻海、勤凱(CB)'},
+        {'date': '2024-01-08', 'wind': '亂流', 'part_time_count': 1, 'worker_strong_list': '聯發科'},
+    ])
+    views = build_day_views(canonical_frame(raw))
+
+    assert list(views) == ['2024-01-05', '2024-01-08']
+    day = views['2024-01-05']
+    assert day['worker_strong_list'] == '台積電、鴻海、勤凱(CB)'
+    assert [name for name, _, _ in day['picks']['worker_strong_list']] == ['台積電', '鴻海', '勤凱']
+    assert day['part_time_count'] == 5
+    assert day['wind'] == '強風'
+    assert day['date'] == '2024-01-05'
+    # 合併後同一天只算一次連續天數
+    assert day['wind_streak'] == 1
+    assert views['2024-01-08']['wind_streak'] == 1